@@ -1,19 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template as flask_render_template, request, redirect, url_for, session, jsonify, flash, g, get_template_attribute
+from markupsafe import Markup
 from urllib.parse import urlencode
-import csv, os
-import pandas as pd
+import os
 import datetime
-import gspread
-from google.oauth2.service_account import Credentials
-from gspread.exceptions import WorksheetNotFound
-import base64
-import json
 import random
+import hmac
+import math
 import re
 import unicodedata
+import signal
+import sys
+import threading
 import time
-import secrets
-import string
+
+from assets import IMMUTABLE_CACHE_CONTROL, AssetManifest, picture_tag
+from cart_store import create_cart_store
+from catalog import Catalog
+from compression import Compressor
+from counterpart import CounterpartWarmer
+from event_wal import EventWAL, acquire_slot, drain_orphan_slots
+from experiment_stats import ExperimentStats
+from form_store import FormWaiters, create_form_store
+from image_manifest import ImageManifest
+import metrics
+from pricing import count_items, summarize_cart
+from profiler import RequestProfiler, collapsed, pstats_dump
+from render_cache import RenderCache, slot
+from reward_store import RewardStore
+from search import ProductSearch
+from sheet_writer import SheetWriter
+from sheets_backend import SheetsBackend
+from sheets_scheduler import HIGH, LOW, QuotaScheduler
 
 
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "12characterPSKey")
@@ -30,21 +47,196 @@ scopes = ['https://www.googleapis.com/auth/spreadsheets']
 service_account_path = 'encoded.txt'  # base64でエンコードされたサービスアカウントキー
 spreadsheet_id = '1KNZ49or81ECH9EVXYeKjAv-ooSnXMbP3dC10e2gQR3g'
 
-with open(service_account_path, 'r') as f:
-    encoded = f.read()
-decoded_json = base64.b64decode(encoded).decode('utf-8')
-service_info = json.loads(decoded_json)
+# Sheets API へのキープアライブ接続の本数（リクエスト処理スレッド＋送信スレッド分）
+SHEETS_POOL_SIZE = int(os.getenv("SHEETS_POOL_SIZE", 10))
+
+# Sheets API の分あたりクォータ（サービスアカウント単位）をワーカー数で分け合う。
+# 報酬コードの読み書きを優先し、クリックログは枠が無ければ遅らせてまとめて送る
+sheets_scheduler = QuotaScheduler(
+    per_minute=float(os.getenv("SHEETS_QUOTA_PER_MIN", 60)) / max(int(os.getenv("WEB_CONCURRENCY", 1)), 1),
+)
+
+# 認証・シート取得は起動後にバックグラウンドで行う（import 時にネットワークに出ない）
+sheets = SheetsBackend(service_account_path, spreadsheet_id, scopes,
+                       pool_size=SHEETS_POOL_SIZE, scheduler=sheets_scheduler)
+
+# /finish の「準備中」画面で Sheets の準備を待つ最大秒数（超えたらローカルの索引だけで発行する）
+SHEETS_READY_TIMEOUT = float(os.getenv("SHEETS_READY_TIMEOUT", 10))
+# ASGI（asgi.py）がイベントループ上で準備待ちを済ませたときに立てる environ のキー
+SHEETS_WAITED_ENVIRON = "experiment.sheets_waited"
+
+# イベントはまずローカルの WAL（data/wal/*.jsonl）に追記し、
+# バックグラウンドでまとめて append_rows する（Sheets 停止中も失われない）
+WAL_DIR = os.getenv("WAL_DIR", os.path.join("data", "wal"))
+
+# /metrics などの管理用エンドポイントのトークン（未設定なら無効）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# ワーカーごとのメトリクスを書き出して /metrics で合算するディレクトリ
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("data", "metrics"))
+
+# 本番での遅延調査用のプロファイラ（既定は無効。/admin/profiles/config で全ワーカーの設定を変えられる）
+profiler = RequestProfiler(
+    directory=os.getenv("PROFILE_DIR", os.path.join("data", "profiles")),
+    config_path=os.path.join(METRICS_DIR, "profiler.json"),
+    enabled=os.getenv("PROFILE_ENABLED", "0") == "1",
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0.01)),
+    endpoints=[e for e in os.getenv("PROFILE_ENDPOINTS", "").split(",") if e],
+    slow_ms=float(os.getenv("PROFILE_SLOW_MS", 1000)),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", 10)) / 1000,
+    capacity=int(os.getenv("PROFILE_CAPACITY", 50)),
+)
+
+# 以下の送信スレッド・WAL・報酬コード索引はワーカープロセスごとに
+# start_background_services() で用意する（fork 前に作ったスレッドは子に引き継がれないため）
+log_writer = None
+rewards_writer = None
+reward_store = None
+experiment_stats = None
+# ログシートから集計を作り直すワーカーか（WAL のスロット 0 を持つ1台だけ）
+_seeds_stats = False
+_services_pid = None
+_services_lock = threading.Lock()
+
+
+def _on_sheets_ready(worksheet, rewards_ws):
+    log_writer.set_worksheet(worksheet)
+    rewards_writer.set_worksheet(rewards_ws)
+    reward_store.set_worksheet(rewards_ws)
+    # 送信済みのログはシートにしか無いので、接続できたら1回だけ読んで集計に足す。
+    # 読むのは1ワーカーだけで、ほかのワーカーは共有ファイル経由で見る
+    if not _seeds_stats:
+        return
+    threading.Thread(target=experiment_stats.load_sheet, args=(worksheet, sheets_scheduler),
+                     name="stats-rebuild", daemon=True).start()
+
+
+def start_background_services(warm=True):
+    """このプロセス用の WAL・送信スレッド・Sheets 接続を開始する（プロセスごとに1回）"""
+    global log_writer, rewards_writer, reward_store, experiment_stats, sheets, _seeds_stats, _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        # ワーカーごとに別の WAL ディレクトリを使う（前のプロセスの未送信分も引き継ぐ）
+        wal_dir = acquire_slot(WAL_DIR)
+        # スロット 0 のロックはそのワーカーが終わるまで外れない（再起動したら引き継いだワーカーが読む）
+        _seeds_stats = wal_dir == WAL_DIR
+        log_wal, rewards_wal = EventWAL(wal_dir, "log"), EventWAL(wal_dir, "rewards")
+        # ワーカー数を減らして使われなくなったスロットの未送信分も引き取る
+        moved = drain_orphan_slots(WAL_DIR, {"log": log_wal, "rewards": rewards_wal})
+        if moved:
+            print(f"[wal] took over {moved} unsent rows from unused slots")
+
+        # 接続が確立するまではログを WAL にためておき、準備ができたら送り始める
+        log_writer = SheetWriter(
+            None,
+            name="log",
+            batch_size=int(os.getenv("LOG_BATCH_SIZE", 100)),
+            flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", 2.0)),
+            wal=log_wal,
+            scheduler=sheets_scheduler,
+            priority=LOW,
+        )
+        rewards_writer = SheetWriter(
+            None,
+            name="rewards",
+            batch_size=20,
+            flush_interval=0.5,
+            wal=rewards_wal,
+            scheduler=sheets_scheduler,
+            priority=HIGH,
+        )
+
+        # rewards シートは一度だけ読み込み、参加者ID・コードの索引で照会する。
+        # 発行の確定はワーカー間で共有する SQLite で行う
+        reward_store = RewardStore(
+            None,
+            writer=rewards_writer,
+            shared_path=os.getenv("REWARDS_STORE_PATH", os.path.join("data", "rewards.sqlite3")),
+            scheduler=sheets_scheduler,
+        )
+
+        # 管理画面の集計。WAL の未送信分とフォーム完了の記録から作り始める
+        experiment_stats = ExperimentStats()
+        experiment_stats.rebuild(log_writer.pending_rows(), form_store.all_done())
+
+        if sheets.started_at is not None:
+            # fork 前に開始済みのものは子では使えないので作り直す
+            sheets = SheetsBackend(service_account_path, spreadsheet_id, scopes,
+                                   pool_size=SHEETS_POOL_SIZE, scheduler=sheets_scheduler)
+        sheets.on_ready(_on_sheets_ready)
+
+        log_writer.start()
+        rewards_writer.start()
+        metrics.REGISTRY.start_sharing(METRICS_DIR)
+        experiment_stats.start_sharing(METRICS_DIR)
+        sheets.start(warm_up=warm_up if warm else None)
+        _services_pid = os.getpid()
+
+
+def stop_background_services(timeout=30.0):
+    """未送信のログを送り切ってから送信スレッドを止める"""
+    if _services_pid != os.getpid():
+        return
+    log_writer.shutdown(timeout)
+    rewards_writer.shutdown(timeout)
+    metrics.REGISTRY.remove_share()
+    experiment_stats.remove_share()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = profiler.begin(request.endpoint)
+
+
+@app.before_request
+def ensure_background_services():
+    if _services_pid != os.getpid():
+        start_background_services()
+
+
+# HTML・JSON・CSS の圧縮（Accept-Encoding に応じて br / gzip）
+compressor = Compressor(min_size=int(os.getenv("COMPRESS_MIN_SIZE", 1024)))
+
+
+@app.after_request
+def compress_response(response):
+    # 最初に登録した after_request は最後に呼ばれる（他のフックが付けたヘッダーも含めて圧縮する）
+    return compressor.process(request, response)
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    # 内容ハッシュ付きの配信用画像は中身が変わらないので長期キャッシュさせる
+    if request.endpoint == "static" and asset_manifest.is_built((request.view_args or {}).get("filename", "")):
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
 
-credentials = Credentials.from_service_account_info(service_info, scopes=scopes)
-gc = gspread.authorize(credentials)
-worksheet = gc.open_by_key(spreadsheet_id).sheet1
 
-try:
-    rewards_ws = gc.open_by_key(spreadsheet_id).worksheet('rewards')
-except WorksheetNotFound:
-    sh = gc.open_by_key(spreadsheet_id)
-    rewards_ws = sh.add_worksheet(title='rewards', rows=1000, cols=10)
-    rewards_ws.append_row(["timestamp", "participant_id", "condition", "site", "reward_code"])
+@app.teardown_request
+def record_request_metrics(exc):
+    started = g.get("request_started")
+    if started is None:
+        return
+    status = 500 if exc is not None else g.get("response_status", 500)
+    endpoint = request.endpoint or "unmatched"
+    elapsed = time.perf_counter() - started
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+    if status >= 500:
+        metrics.REQUEST_ERRORS.inc(endpoint=endpoint)
+    profiler.end(g.get("profile"), elapsed, endpoint=endpoint, method=request.method,
+                 path=request.path, status=status)
+
+
+def render_template(template_name, **context):
+    started = time.perf_counter()
+    try:
+        return flask_render_template(template_name, **context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.TEMPLATE_SECONDS.observe(elapsed, template=template_name)
+        metrics.add_phase("render", elapsed)
 
 
 ID_PATTERN = re.compile(r"^[A-Za-z0-9\-_.]{12}$")
@@ -53,23 +245,63 @@ PROTECTED_ENDPOINTS = {
     "index", "product_detail", "go_product", "go_cart",
     "add_to_cart", "cart", "update_cart", "go_confirm",
     "confirm", "complete", "thanks", "form_embed",
-    "back_to_index", "back_to_cart", "cart_count"
+    "back_to_index", "back_to_cart", "cart_count", "search"
 }
 
-form_status = {}
+# フォーム回答完了の記録（複数ワーカー・再起動をまたいで共有するため既定は SQLite）
+form_store = create_form_store(
+    backend=os.getenv("FORM_STORE", "sqlite"),
+    path=os.getenv("FORM_STORE_PATH", os.path.join("data", "form_status.sqlite3")),
+    ttl=int(os.getenv("FORM_STATUS_TTL", 24 * 3600)),
+)
+
+# /form_status/<pid>/wait で同時に待たせるスレッド数の上限（ワーカーごと）。
+# 残りのスレッドは他のページ用に空けておき、超えた分は短い間隔のポーリングにする
+FORM_WAIT_THREADS = int(os.getenv("FORM_WAIT_THREADS") or max(int(os.getenv("WEB_THREADS", 8)) // 2, 1))
+# 上限を超えたときにクライアントへ伝える問い合わせ間隔（秒）
+FORM_POLL_INTERVAL = float(os.getenv("FORM_POLL_INTERVAL", 3))
+
+# /form_status/<pid>/wait で待っているリクエストを起こすための通知
+form_waiters = FormWaiters(max_threads=FORM_WAIT_THREADS)
+
+# ロングポーリングの最大待ち時間（秒）
+FORM_WAIT_MAX = float(os.getenv("FORM_WAIT_MAX", 25))
+
+
+def parse_wait_seconds(raw, default, maximum):
+    """クエリの待ち秒数を [0, maximum] に収める（数でない・nan・inf なら None）"""
+    if raw is None:
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        return None
+    if not math.isfinite(value):
+        return None
+    return min(max(value, 0.0), maximum)
+
+# 相手サイトはフォーム表示の時点で起こしておく（結果はワーカー間でファイル共有）
+counterpart = CounterpartWarmer(
+    COUNTERPART_BASE_URL,
+    health_path=os.getenv("COUNTERPART_HEALTH_PATH", "/healthz"),
+    warm_ttl=float(os.getenv("COUNTERPART_WARM_TTL", 600)),
+    state_path=os.getenv("COUNTERPART_STATE_PATH", os.path.join("data", "counterpart.json")),
+)
+# 相手サイトが起きていないとき「準備中」画面で待つ最大秒数（過ぎたらそのまま移動する）
+COUNTERPART_PREPARE_MAX = float(os.getenv("COUNTERPART_PREPARE_MAX", 20))
 
 def mark_form_done(pid: str, form_id: str):
-    rec = form_status.setdefault(pid, {"form1": False, "form2": False})
-    if form_id in ("form1", "form2"):
-        rec[form_id] = True
+    form_store.mark_done(pid, form_id)
+    form_waiters.notify(pid, form_id)
+    experiment_stats.record_form(pid, form_id)
 
 def is_form_done(pid: str, form_id: str) -> bool:
-    return bool(form_status.get(pid, {}).get(form_id))
+    return form_store.is_done(pid, form_id)
 
 
 def is_form_submitted(pid: str) -> bool:
     """互換用: どちらか1つでも完了していればTrue"""
-    rec = form_status.get(pid, {})
+    rec = form_store.get(pid)
     return rec.get("form1", False) or rec.get("form2", False)
 
 def normalize_id(s: str) -> str:
@@ -79,6 +311,7 @@ def normalize_id(s: str) -> str:
     s = unicodedata.normalize("NFKC", s.strip())
     return s
 
+@metrics.timed("log_action")
 def log_action(action, page="", total_price=0, products=None, quantities=None, subtotals=None, colors=None, sizes=None):
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     participant_id = session.get("participant_id", "")
@@ -88,8 +321,8 @@ def log_action(action, page="", total_price=0, products=None, quantities=None, s
     subtotals = subtotals or []
     colors = colors or []
     sizes = sizes or []
-    
-    worksheet.append_row([
+
+    row = [
         now, participant_id, condition, action, total_price,
         ",".join(products),
         ",".join(map(str, quantities)),
@@ -97,75 +330,77 @@ def log_action(action, page="", total_price=0, products=None, quantities=None, s
         ",".join(colors),
         ",".join(sizes),
         page
-    ])
+    ]
+    # リクエスト内では WAL に追記し、管理画面の集計を足すだけ（送信はワーカースレッドが行う）
+    log_writer.enqueue(row, pid=participant_id)
+    experiment_stats.observe(row)
 
-def load_products():
-    df = pd.read_csv("data/products.csv", dtype=str).fillna("")  # 欠損を空文字で埋める
-    products = df.to_dict(orient="records")
-    
-    for product in products:
-        product['colors'] = product['colors'].split('|') if product['colors'] else []
-        product['sizes'] = product['sizes'].split('|') if product['sizes'] else []
-    
-    return products
+# 商品カタログはプロセス内に保持し、CSV が更新されたときだけ読み直す
+catalog = Catalog("data/products.csv", "data/specs.csv")
+# 一覧・商品詳細の描画結果（テンプレート・商品・条件・カタログ版ごと）
+render_cache = RenderCache(max_entries=int(os.getenv("RENDER_CACHE_MAX", 512)))
+# 商品検索の索引（カタログ版ごとに1回だけ作る）
+product_search = ProductSearch()
 
+# 配信用画像（tools/build_images.py が作る内容ハッシュ付きのサイズ別 WebP/JPEG）
+asset_manifest = AssetManifest(os.path.join(app.static_folder, "build", "images.json"))
 
-def load_specs():
-    specs = {}
-    with open("data/specs.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # IDをゼロ埋めして確実に一致させる
-            product_id = row["id"].strip().zfill(3)
-            specs[product_id] = row["specs"]
-    return specs
 
-# 半角英数7文字（大文字A-Z + 数字0-9）
-ALPHABET = string.ascii_uppercase + string.digits
-CODE_LEN = 7
+def image_url(filename, variant="gallery", fmt="jpeg"):
+    return url_for("static", filename=asset_manifest.path_for(filename, variant, fmt))
 
-def generate_reward_code() -> str:
-    return ''.join(secrets.choice(ALPHABET) for _ in range(CODE_LEN))
 
-def find_existing_code(pid: str):
-    if not pid:
-        return None
-    try:
-        # 完全一致
-        cell = rewards_ws.find(re.compile(rf'^{re.escape(pid)}$'))
-        if cell:
-            row = rewards_ws.row_values(cell.row)
-            return row[4] if len(row) >= 5 else None
-    except Exception:
-        pass
-    return None
-
-def is_code_duplicated(code: str) -> bool:
-    try:
-        # 完全一致
-        return rewards_ws.find(re.compile(rf'^{re.escape(code)}$')) is not None
-    except Exception:
-        return False
+def image_urls(filename, variant="gallery"):
+    urls = {"jpeg": image_url(filename, variant, "jpeg")}
+    webp = image_url(filename, variant, "webp")
+    if webp.endswith(".webp"):
+        urls["webp"] = webp
+    return urls
+
+
+def picture(filename, variant="thumb", **attrs):
+    return picture_tag(url_for, asset_manifest, filename, variant, **attrs)
+
+
+app.jinja_env.globals.update(image_url=image_url, picture=picture)
+
+# 商品ごとの画像構成（static/images を走査して作る。ファイル増減時のみ作り直し）
+image_manifest = ImageManifest(os.path.join("static", "images"))
+
+# カートの保存先（cookie: 従来どおりセッション内 / memory・sqlite: サーバー側に持ち、
+# セッションには短いカートIDだけを入れる）
+cart_store = create_cart_store(
+    backend=os.getenv("CART_STORE", "cookie"),
+    path=os.getenv("CART_STORE_PATH", os.path.join("data", "carts.sqlite3")),
+    max_carts=int(os.getenv("CART_STORE_MAX", 10000)),
+)
+
+
+def get_cart(snapshot=None):
+    return cart_store.load(session, snapshot or catalog.snapshot())
+
+
+def save_cart(items, snapshot=None):
+    cart_store.save(session, snapshot or catalog.snapshot(), items)
+    g.pop("cart_summary", None)  # カートが変わったら集計をやり直す
+
 
+def get_cart_summary():
+    # 明細・合計・点数はリクエスト内で1回だけ計算する
+    summary = g.get("cart_summary")
+    if summary is None:
+        snapshot = catalog.snapshot()
+        summary = g.cart_summary = summarize_cart(snapshot, get_cart(snapshot))
+    return summary
+
+
+def get_cart_count():
+    return count_items(get_cart())
+
+@metrics.timed("reward_code")
 def get_or_create_reward_code(pid: str, condition: str, site_label: str) -> str:
-    # 既存コードがあれば再利用
-    existing = find_existing_code(pid)
-    if existing:
-        return existing
-
-    # 新規発行（衝突回避を数回試みる）
-    for _ in range(5):
-        code = generate_reward_code()
-        if not is_code_duplicated(code):
-            ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            rewards_ws.append_row([ts, pid, condition, site_label, code])
-            return code
-
-    # 最後の保険
-    code = generate_reward_code()
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    rewards_ws.append_row([ts, pid, condition, site_label, code])
-    return code
+    # 既存コードがあれば再利用、無ければ新規発行（索引はメモリ上で引く）
+    return reward_store.get_or_create(pid, condition, site_label)
 
 
 @app.route('/reset_session')
@@ -219,7 +454,7 @@ def input_id():
 @app.before_request
 def require_participant_id():
     # ID入力や開始画面、静的ファイルは除外
-    if request.endpoint in { "start", "input_id", "set_participant_id", "reset_session", "static", "confirm_id", "notify_form_submit", "form_status_api" }:
+    if request.endpoint in { "start", "input_id", "set_participant_id", "reset_session", "static", "confirm_id", "notify_form_submit", "form_status_api", "form_status_wait", "log_status", "healthz", "readyz" }:
         return
     # 前サイトスキップ経路（start→confirm_id）も考慮して、confirm_idまでは許容
     if request.endpoint in PROTECTED_ENDPOINTS and not session.get("participant_id"):
@@ -276,84 +511,134 @@ def index():
 
     print(f"🧭 Current session condition: {session['condition']}")
 
-    products = load_products()
-
-    for product in products:
-        image = product["image"]
-        colors = product.get("colors", [])
-
-        if image.endswith(".jpg"):
-            base_prefix = image[:-4]  # ".jpg" を除去
-        else:
-            base_prefix = image
-
-        # カラーがあればランダムなカラーバリエーション画像を指定
-        if colors:
-            selected_color = random.choice(colors)
-            product["random_color_image"] = f"{base_prefix}_{selected_color}_1.jpg"
-        else:
-            product["random_color_image"] = image
-
-    cart = session.get("cart", [])
-    cart_count = sum(item['quantity'] for item in cart if isinstance(item, dict) and 'quantity' in item)
+    snapshot = catalog.snapshot()
+    images = image_manifest.for_catalog(snapshot)
 
     if request.method == 'POST':
         log_action("商品一覧表示", page="一覧", products=[], quantities=[], subtotals=[])
 
-    if session["condition"] == "control":
-        return render_template('control_index.html', products=products, cart_count=cart_count)
-    else:
-        return render_template('index.html', products=products, cart_count=cart_count)
+    template_name = 'control_index.html' if session["condition"] == "control" else 'index.html'
+
+    def render():
+        # 実在するカラーバリエーション画像からランダムに1枚。候補が複数ある商品は
+        # 候補ごとにカード画像を描画しておき、表示のたびに1つ選んで差し込む
+        card_picture = get_template_attribute("_card.html", "card_picture")
+        card_images, choices = {}, {}
+        for p in snapshot.products:
+            files = list(images[p.id].color_images.values()) or [images[p.id].default]
+            files = [f for f in files if f]
+            if len(files) > 1:
+                choices[p.id] = [str(card_picture(f, p)) for f in files]
+                card_images[p.id] = Markup(slot(p.id))
+            elif files:
+                card_images[p.id] = card_picture(files[0], p)
+        html = render_template(template_name, products=snapshot.products, card_images=card_images, cart_count=0)
+        return html, choices
+
+    key = (template_name, "", session["condition"], snapshot.version, image_manifest.version, asset_manifest.version)
+    return cached_page(key, render)
 
 
 @app.route('/product/<product_id>', methods=['GET', 'POST'])
 def product_detail(product_id):
-    products = load_products()
-    product = next((p for p in products if p["id"] == product_id), None)
+    snapshot = catalog.snapshot()
+    product = snapshot.get(product_id)
     if not product:
         return "商品が見つかりませんでした", 404
     
-    specs_data = load_specs()
-    cart = session.get("cart", [])
-    cart_count = sum(item['quantity'] for item in cart if isinstance(item, dict) and 'quantity' in item)
-
-    base_prefix = "noimage"
-    image_list = []
-
-    if product and product.get("image"):
-        base_prefix = product["image"].rsplit(".", 1)[0]  # 例: towel_b
-        color_list = product.get("colors", [])
-        default_color = color_list[0] if color_list else ""
-
-        # 1枚目：カラーバリエーション画像（towel_b_sand-beige_1.jpg）
-        first_image = f"{base_prefix}_{default_color}_1.jpg"
-        image_folder = os.path.join("static", "images")
-        if os.path.exists(os.path.join(image_folder, first_image)):
-            image_list.append(first_image)
-
-        # 2枚目以降：共通画像（towel_b_2.jpg, towel_b_3.jpg, ...）
-        for i in range(2, 6):  # 2〜5枚目まで
-            filename = f"{base_prefix}_{i}.jpg"
-            if os.path.exists(os.path.join(image_folder, filename)):
-                image_list.append(filename)
-
     if request.method == 'POST':
         log_action(f"商品詳細表示: {product_id}", page="詳細")
 
-    template_name = 'control_product.html' if session.get("condition") == 'control' else 'product.html' 
+    condition = session.get("condition", "")
+    template_name = 'control_product.html' if condition == 'control' else 'product.html'
+
+    def render():
+        # 画像は起動時に作った一覧から引く（ファイルの存在確認をしない）
+        images = image_manifest.get(snapshot, product_id)
+        default_color = product.colors[0] if product.colors else ""
+        image_list = images.gallery(default_color)
+        color_galleries = {color: images.gallery(color) for color in product.colors}
+        all_images = set(image_list).union(*color_galleries.values())
+
+        return render_template(
+            template_name,
+            product=product,
+            cart_count=0,  # バッジはページ表示後に /cart_count で取得する
+            specs=snapshot.specs.get(product_id, "(商品説明がありません)"),
+            image_list=image_list,
+            color_galleries=color_galleries,  # JSに渡す（カラー → 画像一覧）
+            image_urls={name: image_urls(name, "gallery") for name in sorted(all_images)},
+            image_source=product.image_source  # ← 追加
+        )
+
+    image_manifest.for_catalog(snapshot)
+    key = (template_name, product_id, condition, snapshot.version, image_manifest.version, asset_manifest.version)
+    return cached_page(key, render)
+
+
+
+
+def cached_page(key, render):
+    """描画済みページを返す（ETag が一致すれば 304）
+
+    カード画像を表示のたびに選び直すページは本文が毎回同じではないので、
+    弱い ETag（W/）にする。
+    """
+    page, hit = render_cache.get_or_render(key, render)
+    metrics.RENDER_CACHE.inc(page=key[0], result="hit" if hit else "miss")
+    if request.method == "GET" and request.if_none_match.contains_weak(page.etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(page.fill(), mimetype="text/html")
+    response.set_etag(page.etag, weak=page.varies)
+    # 毎回再検証させる（カートのバッジなど参加者ごとの値は含めていない）
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
-    return render_template(
-        template_name,
-        product=product,
-        cart_count=cart_count,
-        specs=specs_data.get(product_id, "(商品説明がありません)"),
-        image_list=image_list,
-        base_prefix=base_prefix,  # JSに渡す
-        image_source=product.get("image_source", "")  # ← 追加
 
-    )
+def _parse_price(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
 
 
+@app.get("/search")
+def search():
+    # 商品名・説明・スペックの文字 bigram 検索と、色・サイズ・価格での絞り込み
+    # （counts=1 で絞り込み後の色・サイズ別件数も返す）
+    q = request.args.get("q", "").strip()[:100]
+    colors = request.args.getlist("color")
+    sizes = request.args.getlist("size")
+    min_price = _parse_price(request.args.get("min_price"))
+    max_price = _parse_price(request.args.get("max_price"))
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 200))
+    except ValueError:
+        limit = 50
+
+    index = product_search.for_catalog(catalog.snapshot())
+    result = index.search(q, colors=colors, sizes=sizes, min_price=min_price, max_price=max_price, limit=limit,
+                          counts=request.args.get("counts") == "1")
+
+    conditions = [q] if q else []
+    if colors:
+        conditions.append("color=" + "|".join(colors))
+    if sizes:
+        conditions.append("size=" + "|".join(sizes))
+    if min_price is not None or max_price is not None:
+        conditions.append(f"price={min_price or ''}-{max_price or ''}")
+    # 上位10件の商品IDを products 列に残す
+    conditions.append(f"→ {result.total}件")
+    log_action("検索: " + " ".join(conditions), page="検索", products=list(result.ids[:10]))
+
+    return jsonify({
+        "query": q,
+        "ids": list(result.ids),
+        "total": result.total,
+        "facets": result.facets,
+        "all_facets": index.facets,
+    })
 
 
 @app.route('/go_product', methods=['POST'])
@@ -372,10 +657,10 @@ def add_to_cart():
     product_id = request.form["product_id"]
     quantity = int(request.form["quantity"])
 
-    products = load_products()
-    product = next((p for p in products if p["id"] == product_id), None)
+    snapshot = catalog.snapshot()
+    product = snapshot.get(product_id)
 
-    cart = session.get("cart", [])
+    cart = get_cart(snapshot)
 
     # 新しく追加するアイテム
     new_item = {
@@ -400,13 +685,14 @@ def add_to_cart():
     if not found:
         cart.append(new_item)
 
-    session["cart"] = [item for item in cart if isinstance(item, dict) and 'product_id' in item]
+    cart = [item for item in cart if isinstance(item, dict) and 'product_id' in item]
+    save_cart(cart, snapshot)
 
 
 
     if product:
-        name = product["name"]
-        price = int(product["price"])
+        name = product.name
+        price = product.price
         subtotal = price * quantity
 
         log_action("カートに追加", total_price=subtotal,
@@ -416,7 +702,7 @@ def add_to_cart():
 
     # ✅ 非同期(fetch)リクエストの場合はJSONで返す
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        cart_count = sum(item['quantity'] for item in cart if isinstance(item, dict) and 'quantity' in item)
+        cart_count = count_items(cart)
         return jsonify({"cart_count": cart_count})
 
     # ✅ 通常遷移のときはリダイレクト（使っていないなら return "", 204 のままでもOK）
@@ -426,55 +712,37 @@ def add_to_cart():
 
 @app.route('/cart', methods=['GET', 'POST'])
 def cart():
-    products = load_products()
-    cart = session.get("cart", [])
+    snapshot = catalog.snapshot()
+    summary = get_cart_summary()
     cart_items = []
-    total = 0
 
-    for item in cart:
-        if not isinstance(item, dict):
-            continue
-
-        product = next((p for p in products if p["id"] == item["product_id"]), None)
-        if product:
-            subtotal = int(product["price"]) * item["quantity"]
-            total += subtotal
-
-            # ✅ color に基づく画像ファイル名を構築
-            color = item.get("color", "").strip().lower()
-            image_base = product["image"].rsplit(".", 1)[0]  # "mag_c" を取得
-            
-            if color:
-                filename = f"{image_base}_{color}_1.jpg"
-            else:
-                filename = f"{image_base}_1.jpg"
-            image_path = f"images/{image_base}_{color}_1.jpg"
-
-            cart_items.append({
-                "product": product,
-                "quantity": item["quantity"],
-                "subtotal": subtotal,
-                "color": color,
-                "size": item.get("size", ""),
-                "image_path": image_path  # ✅ ここが cart.html で参照される
-            })
+    for line in summary.lines:
+        # ✅ color に対応する画像（無ければ商品の既定画像）
+        color = line.color.strip().lower()
+        filename = image_manifest.get(snapshot, line.product.id).color_image(color)
+
+        cart_items.append({
+            "product": line.product,
+            "quantity": line.quantity,
+            "subtotal": line.subtotal,
+            "color": color,
+            "size": line.size,
+            "image": filename  # ✅ cart.html で picture() に渡す（元のファイル名）
+        })
 
-    
-    cart_count = sum(item['quantity'] for item in cart if isinstance(item, dict) and 'quantity' in item)
-    
     if request.method == 'POST':
-        log_action("カート表示", page="カート", total_price=total,
-                   products=[item["product"]["name"] for item in cart_items],
-                   quantities=[item["quantity"] for item in cart_items],
-                   subtotals=[item["subtotal"] for item in cart_items])
+        log_action("カート表示", page="カート", total_price=summary.total,
+                   products=summary.names,
+                   quantities=summary.quantities,
+                   subtotals=summary.subtotals)
     
     template_name = 'control_cart.html' if session.get("condition") == 'control' else 'cart.html'
 
     return render_template(
         template_name, 
         cart_items=cart_items, 
-        total=total, 
-        cart_count=cart_count,
+        total=summary.total, 
+        cart_count=summary.count,
     )
 
 @app.route('/back_to_index', methods=['POST'])
@@ -493,7 +761,8 @@ def update_cart():
     except (ValueError, TypeError):
         quantity = 1  # 万が一無効な値が来たら1に戻す
 
-    cart = session.get("cart", [])
+    snapshot = catalog.snapshot()
+    cart = get_cart(snapshot)
     new_cart = []
     for item in cart:
         
@@ -508,14 +777,13 @@ def update_cart():
         else:
             new_cart.append(item)  # 存在しない場合でもエラーにしない
 
-    session["cart"] = new_cart
+    save_cart(new_cart, snapshot)
     log_action(f"数量更新: {product_id} → {quantity}", page="カート")
     return redirect(url_for("cart"))
 
 @app.route('/cart_count', methods=['GET'])
 def cart_count():
-    cart = session.get("cart", [])
-    count = sum(item['quantity'] for item in cart if isinstance(item, dict) and 'quantity' in item)
+    count = get_cart_count()
     return jsonify({'count': count})
 
 
@@ -537,83 +805,32 @@ def back_to_cart():
 
 @app.route('/confirm', methods=['GET'])
 def confirm():
-    cart = session.get("cart", [])
-    products = load_products()
-
-    cart_items = []
-    total = 0
-    cart_count = 0
-
-    for item in cart:
-        if not isinstance(item, dict):
-            continue  # 不正なデータはスキップ
-
-        product_id = item['product_id']
-        quantity = item['quantity']
-        product = next((p for p in products if p["id"] == product_id), None)
-
-        if product:
-            subtotal = int(product["price"]) * quantity
-            cart_items.append({
-                "product": product,
-                "quantity": quantity,
-                "subtotal": subtotal,
-                "color": item.get("color", ""),
-                "size": item.get("size", "")
-            })
-            total += subtotal
-            cart_count += quantity
+    summary = get_cart_summary()
 
     log_action("購入確認画面表示", page="確認")
 
     template_name = 'control_confirm.html' if session.get("condition") == 'control' else 'confirm.html'
 
-    return render_template(template_name, cart_items=cart_items, cart_count=cart_count, total=total)
+    return render_template(template_name, cart_items=summary.lines,
+                           cart_count=summary.count, total=summary.total)
 
 
 @app.route('/complete', methods=['POST'])
 def complete():
-    
-    cart = session.get("cart", [])
-    products = load_products()
-
-    product_names = []
-    quantities = []
-    subtotals = []
-
-    total_price = 0
-
-    for item in cart:
-        if not isinstance(item, dict):
-            continue  # 不正なデータはスキップ
-        
-        product_id = item['product_id']
-        quantity = item['quantity']
-        product = next((p for p in products if p["id"] == product_id), None)
-
-        if product:
-            name = product["name"]
-            price = int(product["price"])
-            subtotal = price * quantity
-
-            product_names.append(name)
-            quantities.append(quantity)
-            subtotals.append(subtotal)
-            total_price += subtotal
-
-    colors = [item.get("color", "") for item in cart]
-    sizes = [item.get("size", "") for item in cart]
-
-    log_action("購入確定", total_price=total_price,
-            products=product_names,
-            quantities=quantities,
-            subtotals=subtotals,
+    summary = get_cart_summary()
+    colors = [item.get("color", "") for item in summary.items]
+    sizes = [item.get("size", "") for item in summary.items]
+
+    log_action("購入確定", total_price=summary.total,
+            products=summary.names,
+            quantities=summary.quantities,
+            subtotals=summary.subtotals,
             colors=colors,
             sizes=sizes,
             page="確認")
 
 
-    session["cart"] = []  # ✅ カートを空にするのはログ記録のあと
+    save_cart([])  # ✅ カートを空にするのはログ記録のあと
 
     return redirect(url_for("thanks"))
 
@@ -635,6 +852,9 @@ def form_embed():
     expect_form = "form2" if from_previous == "1" else "form1"
 
     log_action('Googleフォーム埋め込み表示', page=f'/form_embed:{expect_form}')
+    if expect_form == "form1":
+        # 回答している間に相手サイトのコールドスタートを済ませておく
+        counterpart.poke("form_embed")
     return render_template(
         'googleform.html',
         participant_id=participant_id,
@@ -683,6 +903,38 @@ def form_status_api(pid):
     return jsonify({"done": is_form_done(pid, expect)})
 
 
+@app.get("/form_status/<pid>/wait")
+def form_status_wait(pid):
+    # ロングポーリング: 完了するか timeout 秒経つまで応答を保留する
+    expect = request.args.get("expect")
+    if expect not in ("form1", "form2"):
+        return jsonify({"error": "expect param required"}), 400
+    timeout = parse_wait_seconds(request.args.get("timeout"), FORM_WAIT_MAX, FORM_WAIT_MAX)
+    if timeout is None:
+        return jsonify({"error": "bad timeout"}), 400
+    done = form_waiters.wait(pid, expect, lambda: is_form_done(pid, expect), timeout)
+    if done is None:
+        # 待てるスレッドが埋まっている → 待たずに返し、少し後に問い合わせ直してもらう
+        return jsonify({"done": False, "retry_after": FORM_POLL_INTERVAL})
+    return jsonify({"done": done})
+
+
+@app.get("/log_status")
+def log_status():
+    # 参加者向けには「その pid の未送信行があるか」だけを返す。
+    # キュー・WAL の詳細（直近のエラーを含む）は管理者のみ
+    pid = request.args.get("pid")
+    if not _is_admin():
+        if not pid:
+            return "forbidden", 403
+        return jsonify({"pid": pid, "pending": log_writer.pending(pid) > 0})
+    stats = log_writer.stats()
+    if pid:
+        stats["pid"] = pid
+        stats["pid_in_flight"] = log_writer.pending(pid)
+    stats["rewards"] = rewards_writer.stats()
+    return jsonify(stats)
+
 
 @app.get("/guard_to_next")
 def guard_to_next():
@@ -704,6 +956,15 @@ def guard_to_next():
 
     # 1サイト目なら相手サイトへ
     if COUNTERPART_BASE_URL:
+        # 相手サイトがまだ起きていなければ「準備中」画面で待ってから戻ってくる
+        if request.args.get("prepared") != "1" and not counterpart.is_warm():
+            counterpart.poke("guard")
+            return render_template(
+                "preparing.html",
+                next_url=url_for("guard_to_next", prepared="1", pid=request.args.get("pid")),
+                status_url=url_for("counterpart_status"),
+                max_wait=COUNTERPART_PREPARE_MAX,
+            )
         qs = urlencode({
             "from_previous": "1",
             "participant_id": session.get("participant_id", ""),
@@ -716,6 +977,12 @@ def guard_to_next():
     return redirect(url_for(DEST_ROUTE_AFTER_FORM))
 
 
+@app.get("/counterpart_status")
+def counterpart_status():
+    # 「準備中」画面からの問い合わせ。待たずに今の状態を返す（画面の側で1秒おきに問い合わせる）
+    counterpart.poke("status")
+    return jsonify({"warm": counterpart.is_warm()})
+
 
 @app.route("/finish")
 def finish():
@@ -723,6 +990,20 @@ def finish():
     condition = session.get("condition", "experiment")
     site_label = "experiment"  # experimentサイト固定
     
+    # 起動直後で rewards シートをまだ読めていなければ、リクエストのスレッドでは待たずに
+    # 「準備中」画面を返し、ブラウザ側で /readyz を見ながら待ってもらう（間に合わなければ
+    # prepared=1 で戻ってきてローカルの索引で発行）。ASGI 経由ならもうループ上で待ち終えている
+    ready = sheets.ready.is_set()
+    if not ready and request.args.get("prepared") != "1" and not request.environ.get(SHEETS_WAITED_ENVIRON):
+        return render_template(
+            "preparing.html",
+            next_url=url_for("finish", prepared="1"),
+            status_url=url_for("readyz"),
+            max_wait=SHEETS_READY_TIMEOUT,
+        )
+    if not ready:
+        print(f"[finish] Sheets not ready, issuing from local index: {sheets.status()}")
+
     # 報酬コードを取得（既存あれば再利用、無ければ新規発行）
     reward_code = get_or_create_reward_code(pid, condition, site_label)
     
@@ -730,6 +1011,155 @@ def finish():
     return render_template("finish.html", reward_code=reward_code)
 
 
+@app.get("/healthz")
+def healthz():
+    return jsonify({"ok": True})
+
+
+@app.get("/readyz")
+def readyz():
+    # Sheets の準備ができていれば 200、まだなら 503（ログは WAL にたまっている）
+    status = sheets.status()
+    status["log_pending"] = log_writer.pending()
+    status["counterpart"] = counterpart.status()
+    status["quota"] = sheets_scheduler.stats()
+    return jsonify(status), (200 if status["ready"] else 503)
+
+
+def _is_admin():
+    # Authorization: Bearer <ADMIN_TOKEN> のみ（クエリに載せるとアクセスログや履歴に残る）
+    if not ADMIN_TOKEN:
+        return False
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(auth[len("Bearer "):].encode(), ADMIN_TOKEN.encode())
+
+
+metrics.REGISTRY.gauge_callback(
+    "sheets_ready", "1 when the Sheets connection of this worker is ready",
+    lambda: int(sheets.ready.is_set()))
+metrics.REGISTRY.gauge_callback(
+    "log_rows_pending", "Rows waiting in the WAL of this worker, by sheet",
+    lambda: {(("sheet", "log"),): log_writer.pending(), (("sheet", "rewards"),): rewards_writer.pending()})
+metrics.REGISTRY.gauge_callback(
+    "sheets_quota_tokens", "Sheets calls this worker may make right now without waiting",
+    lambda: sheets_scheduler.stats()["tokens"])
+metrics.REGISTRY.gauge_callback(
+    "counterpart_warm", "1 when the counterpart site answered a warm-up ping recently",
+    lambda: int(counterpart.is_warm()))
+metrics.REGISTRY.gauge_callback(
+    "form_waiters", "Long-poll requests waiting for form completion in this worker",
+    form_waiters.waiting)
+metrics.REGISTRY.gauge_callback(
+    "form_wait_rejected", "Long-polls answered at once because the wait threads were full (since start)",
+    lambda: form_waiters.rejected)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus テキスト形式（Authorization: Bearer <ADMIN_TOKEN>）
+    if not _is_admin():
+        return "forbidden", 403
+    return metrics.REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def _admin_stats():
+    # 全ワーカーの集計（ほかのワーカーの分は最大 10 秒遅れ）
+    # 報酬コードの発行数は RewardStore の発行記録（全ワーカーで共有する SQLite）から数える
+    stats = experiment_stats.merged().summary(rewarded=reward_store.issued_pids())
+    stats["reward_codes_indexed"] = reward_store.stats()["participants"]  # 両サイトで発行済みの人数
+    stats["log_pending"] = log_writer.pending()
+    stats["generated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return stats
+
+
+@app.get("/admin/stats")
+def admin_stats():
+    # 実験の進み具合（条件別の人数・ファネル・購入・フォーム完了・報酬発行）。
+    # ブラウザで見るときはヘッダーを付ける拡張機能などで Authorization を送る
+    if not _is_admin():
+        return "forbidden", 403
+    return render_template("admin_stats.html", stats=_admin_stats())
+
+
+@app.get("/admin/stats.json")
+def admin_stats_json():
+    if not _is_admin():
+        return "forbidden", 403
+    return jsonify(_admin_stats()), 200, {"Cache-Control": "no-store"}
+
+
+@app.get("/admin/profiles")
+def admin_profiles():
+    # 残っているプロファイルの一覧（スタックは除く）と現在の設定
+    if not _is_admin():
+        return "forbidden", 403
+    records = [{k: v for k, v in r.items() if k not in ("frames", "samples")} for r in profiler.records()]
+    return jsonify({"profiler": profiler.stats(), "profiles": records[::-1]}), 200, {"Cache-Control": "no-store"}
+
+
+@app.post("/admin/profiles/config")
+def admin_profiles_config():
+    # enabled / sample_rate / endpoints（カンマ区切り）/ slow_ms を変える。全ワーカーに1秒以内に反映
+    if not _is_admin():
+        return "forbidden", 403
+    data = request.get_json(silent=True) or request.form
+    try:
+        endpoints = data.get("endpoints")
+        if isinstance(endpoints, str):
+            endpoints = [e.strip() for e in endpoints.split(",") if e.strip()]
+        enabled = data.get("enabled")
+        if isinstance(enabled, str):
+            enabled = enabled.lower() in ("1", "true", "on", "yes")
+        config = profiler.update_config(
+            enabled=enabled,
+            sample_rate=float(data["sample_rate"]) if data.get("sample_rate") not in (None, "") else None,
+            endpoints=endpoints,
+            slow_ms=float(data["slow_ms"]) if data.get("slow_ms") not in (None, "") else None,
+        )
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid value"}), 400
+    return jsonify(config)
+
+
+@app.get("/admin/profiles/<rid>.<fmt>")
+def admin_profile_download(rid, fmt):
+    # 1件（rid="all" なら全件をまとめて）を flame graph 用に書き出す
+    if not _is_admin():
+        return "forbidden", 403
+    records = profiler.get(rid)
+    if not records:
+        return "not found", 404
+    if fmt == "collapsed":
+        body, mimetype = collapsed(records), "text/plain; charset=utf-8"
+    elif fmt == "pstats":
+        body, mimetype = pstats_dump(records), "application/octet-stream"
+    elif fmt == "json":
+        return jsonify(records if rid == "all" else records[0])
+    else:
+        return "unknown format (collapsed / pstats / json)", 404
+    return body, 200, {
+        "Content-Type": mimetype,
+        "Content-Disposition": f'attachment; filename="profile-{rid}.{fmt}"',
+        "Cache-Control": "no-store",
+    }
+
+
+def warm_up():
+    # カタログ・スペック・画像一覧・テンプレートを先に読み込んでおく
+    snapshot = catalog.snapshot()
+    image_manifest.for_catalog(snapshot)
+    product_search.for_catalog(snapshot)
+    for name in app.jinja_env.list_templates():
+        if name.endswith(".html") and not name.startswith("#"):
+            app.jinja_env.get_template(name)
+
+
 if __name__ == '__main__':
+    # 開発用サーバー（本番は gunicorn -c gunicorn.conf.py app:app）
+    # SIGTERM でも atexit（ログキューのフラッシュ）が走るようにする
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    start_background_services()
     port = int(os.environ.get("PORT", 10000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,224 @@
+"""ASGI で配信する入口（uvicorn asgi:application --host 0.0.0.0 --port $PORT）
+
+URL・テンプレート・セッションは app.py の Flask アプリと同じ。待ち時間の長い
+ルートだけをイベントループ上で待ち、スレッドを占有しない:
+
+    /form_status/<pid>/wait    回答完了の long-poll（FormWaiters.wait_async）
+    /finish                    Sheets の準備待ちをループ上で済ませてから Flask に渡す
+
+それ以外のルートは WSGIBridge が ASGI_THREADS 本のスレッドプールで Flask に渡す。
+Sheets への書き込みはもともと WAL とバックグラウンドの送信スレッドが行い、
+報酬コードはメモリ上の索引で引くので、ルートの処理がスレッドを長く占めることは少ない。
+
+uvicorn は WEB_CONCURRENCY をワーカー数として読む（Sheets のクォータの分け方も同じ値を使う）。
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+
+import app as flask_app
+import metrics
+
+
+# Flask（WSGI）の処理と、ストアの確認など短いブロッキング処理に使うスレッド数
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", 32))
+
+
+def _latin1(text):
+    return text.encode("utf-8").decode("latin-1")
+
+
+class WSGIBridge:
+    """ASGI のリクエストを WSGI アプリに渡す（処理は executor のスレッドで行う）"""
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    @staticmethod
+    async def read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": _latin1(scope.get("root_path", "")),
+            "PATH_INFO": _latin1(scope["path"]),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1] or 80),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for raw_name, raw_value in scope.get("headers", []):
+            name = raw_name.decode("latin-1").upper().replace("-", "_")
+            value = raw_value.decode("latin-1")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            if key in environ:
+                environ[key] += ("; " if key == "HTTP_COOKIE" else ",") + value
+            else:
+                environ[key] = value
+        return environ
+
+    def _run(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], body
+
+    async def __call__(self, scope, receive, send, extra=None):
+        body = await self.read_body(receive)
+        environ = self.environ(scope, body)
+        environ.update(extra or {})
+        loop = asyncio.get_running_loop()
+        status, headers, data = await loop.run_in_executor(self.executor, self._run, environ)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode() + b"\n"
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"cache-control", b"no-store")],
+    })
+    await send({"type": "http.response.body", "body": body})
+    return status
+
+
+def query_params(scope):
+    return {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+
+
+class ASGIApp:
+    """長く待つルートだけ async で処理し、残りは WSGIBridge に渡す"""
+
+    def __init__(self, threads=ASGI_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.bridge = WSGIBridge(flask_app.app, self.executor)
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # ---- 非同期のルート ----
+
+    async def form_status_wait(self, scope, receive, send, pid=""):
+        params = query_params(scope)
+        expect = params.get("expect")
+        if expect not in ("form1", "form2"):
+            return await send_json(send, {"error": "expect param required"}, 400)
+        timeout = flask_app.parse_wait_seconds(params.get("timeout"), flask_app.FORM_WAIT_MAX,
+                                               flask_app.FORM_WAIT_MAX)
+        if timeout is None:
+            return await send_json(send, {"error": "bad timeout"}, 400)
+
+        async def check():
+            return await self.run_blocking(flask_app.is_form_done, pid, expect)
+
+        done = await flask_app.form_waiters.wait_async(pid, expect, check, timeout)
+        return await send_json(send, {"done": done})
+
+    async def finish(self, scope, receive, send):
+        # 起動直後の Sheets 準備待ち（最大 SHEETS_READY_TIMEOUT 秒）をループ上で済ませる。
+        # 報酬コードの発行・ログ・セッションは Flask の /finish がそのまま行う
+        deadline = time.monotonic() + flask_app.SHEETS_READY_TIMEOUT
+        while not flask_app.sheets.ready.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        # 待ち終えたことを伝え、Flask 側ではもう待たせない（スレッドを占有しない）
+        await self.bridge(scope, receive, send, extra={flask_app.SHEETS_WAITED_ENVIRON: True})
+
+    def route(self, scope):
+        if scope["method"] != "GET":
+            return None
+        path = scope["path"]
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "form_status" and parts[2] == "wait":
+            return "form_status_wait", partial(self.form_status_wait, pid=parts[1])
+        if path == "/finish":
+            return None, self.finish
+        return None
+
+    # ---- ASGI ----
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.run_blocking(flask_app.start_background_services)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.run_blocking(flask_app.stop_background_services)
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        matched = self.route(scope)
+        if matched is None:
+            return await self.bridge(scope, receive, send)
+        endpoint, handler = matched
+        if endpoint is None:
+            return await handler(scope, receive, send)  # 計測は Flask 側で行う
+        started = time.perf_counter()
+        status = 500
+        try:
+            status = await handler(scope, receive, send)
+        finally:
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                            endpoint=endpoint, method="GET", status=status)
+            if status >= 500:
+                metrics.REQUEST_ERRORS.inc(endpoint=endpoint)
+
+
+application = ASGIApp()
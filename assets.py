@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import time
+
+from markupsafe import Markup, escape
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class AssetManifest:
+    """tools/build_images.py が書き出した static/build/images.json を引く
+
+    元のファイル名（mag_a_1.jpg）と用途（thumb / gallery）から、内容ハッシュ付きの
+    配信用ファイルの static 相対パスを返す。マニフェストが無い・載っていない
+    画像は従来どおり images/<元のファイル名> を返す（ビルド前の開発環境でも動く）。
+    ファイルの mtime を check_interval 秒に 1 回まで確認し、変わったら読み直す。
+    """
+
+    def __init__(self, path=os.path.join("static", "build", "images.json"), check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._images = {}
+        self._base = ""
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f) if mtime is not None else {}
+            except (OSError, ValueError) as e:
+                print(f"[assets] manifest load failed, keeping previous: {e!r}")
+                return
+            self._images = data.get("images", {})
+            self._base = data.get("base", "")
+            self._mtime = mtime
+
+    @property
+    def version(self):
+        self._refresh()
+        return self._mtime
+
+    def path_for(self, filename, variant="gallery", fmt="jpeg"):
+        """static フォルダからの相対パス（無い形式は jpeg、無い画像は元ファイル）"""
+        self._refresh()
+        entry = self._images.get(filename)
+        if entry:
+            files = entry["variants"].get(variant, {})
+            built = files.get(fmt) or files.get("jpeg")
+            if built:
+                return f"{self._base}/{built}"
+        return f"images/{filename}"
+
+    def is_built(self, static_path):
+        return bool(self._base) and static_path.startswith(self._base + "/")
+
+
+def picture_tag(url_for, manifest, filename, variant, **attrs):
+    """WebP を優先し、非対応ブラウザには JPEG を出す <picture> 要素"""
+    jpeg = url_for("static", filename=manifest.path_for(filename, variant, "jpeg"))
+    webp_path = manifest.path_for(filename, variant, "webp")
+    attr_html = "".join(f' {escape(k.replace("_", "-"))}="{escape(v)}"' for k, v in attrs.items())
+    img = f'<img src="{escape(jpeg)}"{attr_html} loading="lazy">'
+    if not webp_path.endswith(".webp"):
+        return Markup(img)
+    webp = url_for("static", filename=webp_path)
+    return Markup(f'<picture><source type="image/webp" srcset="{escape(webp)}">{img}</picture>')
@@ -0,0 +1,102 @@
+"""tools/analytics.py の処理時間と最大メモリ
+
+log_action と同じ列の合成イベントログ（参加者ごとに 一覧→詳細→追加→カート→確認→購入）を
+CSV に書き、チャンクを変えて集計したときの時間と最大 RSS を測る。
+
+    python -m benchmarks.analytics_bench --participants 100000 --chunksize 200000
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.cold_start import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+import analytics  # noqa: E402
+
+PRODUCTS = ["マグカップA", "マグカップB", "グラスC", "プレートD", "ボウルE"]
+COLORS = ["white", "blue", "navy", "glass"]
+SIZES = ["S", "M", "L"]
+
+
+def write_log(path, participants, seed=1):
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 6, 1, 9, 0, 0)
+    events = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(analytics.LOG_COLUMNS)
+        for n in range(participants):
+            pid = f"P{n:07d}"
+            condition = rng.choice(["A", "B"])
+            t = start + datetime.timedelta(seconds=n)
+
+            def row(action, page, total=0, items=()):
+                nonlocal t, events
+                t += datetime.timedelta(seconds=rng.randint(2, 90))
+                events += 1
+                writer.writerow([
+                    t.strftime("%Y-%m-%d %H:%M:%S"), pid, condition, action, total,
+                    ",".join(i[0] for i in items), ",".join(str(i[1]) for i in items),
+                    ",".join(str(i[2]) for i in items), ",".join(i[3] for i in items),
+                    ",".join(i[4] for i in items), page,
+                ])
+
+            row("条件決定", "index")
+            row("商品一覧表示", "一覧")
+            items = []
+            for _ in range(rng.randint(0, 4)):
+                row(f"商品詳細表示: {rng.randint(1, 30):03d}", "詳細")
+                if rng.random() < 0.6:
+                    qty = rng.randint(1, 3)
+                    item = (rng.choice(PRODUCTS), qty, qty * 1200, rng.choice(COLORS), rng.choice(SIZES))
+                    items.append(item)
+                    row("カートに追加", "詳細", item[2], [item[:3] + ("", "")])
+            if items and rng.random() < 0.8:
+                total = sum(i[2] for i in items)
+                row("カート表示", "カート", total, [i[:3] + ("", "") for i in items])
+                if rng.random() < 0.8:
+                    row("確認画面へ進む", "カート")
+                    row("購入確認画面表示", "確認")
+                    if rng.random() < 0.9:
+                        row("購入確定", "確認", total, items)
+            row("実験終了", "finish")
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, default=100_000)
+    parser.add_argument("--chunksize", type=int, default=200_000)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="parquet")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "log.csv")
+        t0 = time.perf_counter()
+        events = write_log(log_path, args.participants)
+        size = os.path.getsize(log_path) / 1024 / 1024
+        print(f"generated {events} events ({size:.0f} MiB) in {time.perf_counter() - t0:.1f}s")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        t0 = time.perf_counter()
+        summary = analytics.run([log_path], os.path.join(tmp, "out"), args.format, args.chunksize)
+        elapsed = time.perf_counter() - t0
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{summary['events']} events, {summary['line_items']} line items, "
+              f"{summary['participants']} participants in {elapsed:.1f}s "
+              f"({summary['events'] / elapsed:,.0f} events/s), max RSS {rss_before:.0f} → {rss_after:.0f} MiB")
+
+        funnel = analytics.pd.read_csv(os.path.join(tmp, "out", "funnel.csv")) if args.format == "csv" else \
+            analytics.pd.read_parquet(os.path.join(tmp, "out", "funnel.parquet"))
+        print(funnel.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""コールドスタートから最初の応答バイトまでの時間を計測する
+
+オフラインのフェイク Sheets（認証・シート取得に --auth-latency 秒ずつかかる）で
+app.py を起動し、GET / が最初に返るまでと /readyz が 200 になるまでを測る。
+以前は import 時に認証していたので「最初の応答」は「Sheets 準備完了」より後だった。
+
+    python benchmarks/cold_start.py --runs 3 --auth-latency 0.5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAUNCHER = """
+import runpy, sys
+sys.path.insert(0, {root!r})
+from benchmarks import fake_sheets
+fake_sheets.install(auth_latency={auth_latency})
+runpy.run_path("app.py", run_name="__main__")
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, ok_status=(200,), deadline=60.0):
+    start = time.perf_counter()
+    while time.perf_counter() - start < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as res:
+                res.read(1)
+                if res.status in ok_status:
+                    return time.perf_counter()
+        except urllib.error.HTTPError as e:
+            if e.code in ok_status:
+                return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(url)
+
+
+def run_once(auth_latency):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WAL_DIR=tempfile.mkdtemp(prefix="wal-"),
+               FORM_STORE="memory", PYTHONUNBUFFERED="1")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", LAUNCHER.format(root=ROOT, auth_latency=auth_latency)],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_byte = wait_for(f"http://127.0.0.1:{port}/") - t0
+        ready = wait_for(f"http://127.0.0.1:{port}/readyz") - t0
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return first_byte, ready
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--auth-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = [run_once(args.auth_latency) for _ in range(args.runs)]
+    first = statistics.median(r[0] for r in results)
+    ready = statistics.median(r[1] for r in results)
+    print(f"first byte: {first * 1000:.0f} ms   sheets ready: {ready * 1000:.0f} ms   "
+          f"(authorize + open_by_key: {args.auth_latency}s each)")
+    print(json.dumps({"first_byte_s": first, "ready_s": ready, "runs": results}))
+
+
+if __name__ == "__main__":
+    main()
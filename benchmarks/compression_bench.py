@@ -0,0 +1,80 @@
+"""応答圧縮の転送量と CPU コストを計測する
+
+アプリをプロセス内で（Flask の test client で）動かし、主なページを
+identity / gzip / br で取得して、本文のバイト数と1リクエストあたりの
+CPU 時間（time.process_time）を比べる。cold は圧縮結果のキャッシュを
+毎回捨てた場合、warm はキャッシュが効いている場合。
+
+    python -m benchmarks.compression_bench --requests 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.cold_start import ROOT
+
+PATHS = ["/index", "/product/001", "/cart", "/confirm", "/static/style.css", "/static/build/images.json"]
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def setup():
+    tmp = tempfile.mkdtemp(prefix="compress-")
+    os.environ.setdefault("WAL_DIR", os.path.join(tmp, "wal"))
+    os.environ.setdefault("METRICS_DIR", os.path.join(tmp, "metrics"))
+    os.environ.setdefault("FORM_STORE_PATH", os.path.join(tmp, "form_status.sqlite3"))
+    os.environ.setdefault("REWARDS_STORE_PATH", os.path.join(tmp, "rewards.sqlite3"))
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from benchmarks import fake_sheets
+    fake_sheets.install()
+    import app
+    client = app.app.test_client()
+    client.post("/set_id", data={"participant_id": "BENCHCOMPRES"})
+    client.post("/add_to_cart", data={"product_id": "001", "quantity": "2", "color": "gray"})
+    return app, client
+
+
+def measure(app, client, path, encoding, requests, warm):
+    headers = {"Accept-Encoding": encoding}
+    res = client.get(path, headers=headers)
+    if res.status_code != 200:
+        return None
+    size = len(res.data)
+    start = time.process_time()
+    for _ in range(requests):
+        if not warm:
+            app.compressor.clear()
+        client.get(path, headers=headers)
+    cpu = (time.process_time() - start) / requests
+    return {"bytes": size, "cpu_ms": cpu * 1000, "encoding": res.headers.get("Content-Encoding", "identity")}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    app, client = setup()
+    results = []
+    print(f"{'path':28s} {'enc':9s} {'bytes':>8s} {'ratio':>6s} {'cold ms':>8s} {'warm ms':>8s}")
+    for path in PATHS:
+        base = None
+        for encoding in ENCODINGS:
+            cold = measure(app, client, path, encoding, args.requests, warm=False)
+            if cold is None:
+                break
+            warm = measure(app, client, path, encoding, args.requests, warm=True)
+            base = base or cold["bytes"]
+            row = {"path": path, "accept": encoding, "encoding": cold["encoding"], "bytes": cold["bytes"],
+                   "cold_cpu_ms": cold["cpu_ms"], "warm_cpu_ms": warm["cpu_ms"]}
+            results.append(row)
+            print(f"{path:28s} {row['encoding']:9s} {row['bytes']:8d} {row['bytes'] / base:6.2f} "
+                  f"{row['cold_cpu_ms']:8.3f} {row['warm_cpu_ms']:8.3f}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""gspread の Worksheet を模したオフライン用スタンドイン（ベンチマーク用）"""
+import datetime
+import random
+import re
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+
+class _QuotaResponse:
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}}
+
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeQuota:
+    """window 秒あたり limit 回を超えた呼び出しに 429 を返す（複数シートで共有する）"""
+
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._calls = []
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self):
+        now = time.monotonic()
+        with self._lock:
+            self._calls = [t for t in self._calls if now - t < self.window]
+            if len(self._calls) >= self.limit:
+                self.rejected += 1
+                raise APIError(_QuotaResponse())
+            self._calls.append(now)
+
+
+class FakeWorksheet:
+    """latency 秒の遅延と quota_error_rate の確率で 429 を返すワークシート
+
+    quota（FakeQuota）を渡すと、分あたりの上限を超えた呼び出しも 429 にする。
+    """
+
+    def __init__(self, title="sheet1", latency=0.0, quota_error_rate=0.0, rows=None, quota=None):
+        self.title = title
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.quota = quota
+        self.rows = [list(r) for r in (rows or [])]
+        self.calls = 0
+        self.quota_errors = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.quota is not None:
+            try:
+                self.quota.take()
+            except APIError:
+                with self._lock:
+                    self.quota_errors += 1
+                raise
+        if self.quota_error_rate and random.random() < self.quota_error_rate:
+            with self._lock:
+                self.quota_errors += 1
+            raise APIError(_QuotaResponse())
+
+    def append_row(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self.rows.extend([str(v) for v in row] for row in values)
+
+    def get_all_values(self, **kwargs):
+        self._call()
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def row_values(self, row, **kwargs):
+        self._call()
+        with self._lock:
+            return list(self.rows[row - 1])
+
+    def find(self, query, **kwargs):
+        self._call()
+        with self._lock:
+            rows = [list(r) for r in self.rows]
+        for i, row in enumerate(rows, 1):
+            for j, value in enumerate(row, 1):
+                if isinstance(query, re.Pattern):
+                    if query.search(value):
+                        return FakeCell(i, j, value)
+                elif value == query:
+                    return FakeCell(i, j, value)
+        return None
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency=0.0, quota_error_rate=0.0):
+        self.sheet1 = FakeWorksheet("sheet1", latency, quota_error_rate)
+        self._sheets = {"rewards": FakeWorksheet("rewards", latency, quota_error_rate)}
+
+    def worksheet(self, title):
+        return self._sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self._sheets[title] = FakeWorksheet(title, self.sheet1.latency, self.sheet1.quota_error_rate)
+        return self._sheets[title]
+
+
+class FakeCredentials:
+    """トークン取得だけを模した資格情報（SheetsTransport の更新スレッド用）"""
+
+    def __init__(self, lifetime=3600.0):
+        self.lifetime = lifetime
+        self.token = None
+        self.expiry = None
+
+    @property
+    def valid(self):
+        return self.token is not None and self.expiry > datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    def refresh(self, request):
+        self.token = f"fake-{time.monotonic()}"
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        self.expiry = now + datetime.timedelta(seconds=self.lifetime)
+
+    def before_request(self, request, method, url, headers):
+        if not self.valid:
+            self.refresh(request)
+
+
+class FakeClient:
+    def __init__(self, spreadsheet, auth_latency=0.0):
+        self.spreadsheet = spreadsheet
+        self.auth_latency = auth_latency
+
+    def set_timeout(self, timeout):
+        pass
+
+    def open_by_key(self, key):
+        if self.auth_latency:
+            time.sleep(self.auth_latency)
+        return self.spreadsheet
+
+
+def install(latency=0.0, quota_error_rate=0.0, auth_latency=0.0):
+    """gspread の認証・接続をフェイクに差し替える（app を import する前に呼ぶ）
+
+    auth_latency は認証と open_by_key それぞれにかかる遅延（秒）。
+    """
+    import gspread
+    from google.oauth2 import service_account
+
+    spreadsheet = FakeSpreadsheet(latency, quota_error_rate)
+
+    def authorize(credentials, **kwargs):
+        if auth_latency:
+            time.sleep(auth_latency)
+        return FakeClient(spreadsheet, auth_latency)
+
+    gspread.authorize = authorize
+    service_account.Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: FakeCredentials())
+    return spreadsheet
@@ -0,0 +1,233 @@
+"""参加者の一連の画面遷移を N 人同時に流す負荷試験
+
+フェイク Sheets（--sheets-latency 秒の遅延、--quota-error-rate の確率で 429）で
+サーバーを起動し、仮想参加者が次の順にリクエストする:
+
+    / → /set_id → /confirm_id → /index → /product/<id> → /add_to_cart → /cart
+    → /update_cart → /confirm → /complete → /thanks → /form_embed
+    → /notify_form_submit → /guard_to_next → /finish
+
+2サイト目として入る（/?from_previous=1）ので /guard_to_next は相手サイトに
+飛ばずローカルの /finish へ進む。リダイレクトは追わず、各ルートを1回ずつ計る。
+--form-time を付けると、フォームに答えている間（その秒数）は回答完了の
+long-poll（/form_status/<pid>/wait）を張ったままにする。
+ルートごとの p50/p95/p99 と全体のスループットを表示し、結果を JSON で保存する。
+--baseline に以前の結果を渡すと p95 と req/s の差分を表示する。
+
+    python -m benchmarks.journey_bench --participants 20 --journeys 5
+    python -m benchmarks.journey_bench --mode gunicorn --quota-error-rate 0.1 \\
+        --baseline benchmarks/results/journey-20261018-120000.json
+    python -m benchmarks.journey_bench --mode uvicorn --participants 200 --journeys 1 --form-time 5
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from benchmarks.cold_start import ROOT
+from benchmarks.serve_bench import ADMIN_TOKEN, LAUNCHERS, start_server
+
+sys.path.insert(0, ROOT)
+from catalog import load_products  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "12characterPSKey")
+FORM2_CODE = os.getenv("FORM2_CODE", "F2_SECRET_CODE")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Participant:
+    """Cookie を持つ仮想参加者。リクエストごとにルート名で所要時間を記録する"""
+
+    def __init__(self, base, products, timings, errors, think_time=0.0, form_time=0.0):
+        self.base = base
+        self.products = products
+        self.timings = timings
+        self.errors = errors
+        self.think_time = think_time
+        self.form_time = form_time
+        self.pid = "".join(random.choices(string.ascii_letters + string.digits, k=12))
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, route, path, data=None, headers=None, expect=(200,)):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base + path, data=body, headers=headers or {})
+        t0 = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=60) as res:
+                res.read()
+                status = res.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except Exception as e:
+            status = repr(e)
+        elapsed = time.perf_counter() - t0
+        self.timings[route].append(elapsed)
+        if status not in expect:
+            self.errors[route].append(status)
+        if self.think_time:
+            time.sleep(random.uniform(0, self.think_time))
+
+    def journey(self):
+        product = random.choice(self.products)
+        color = product.colors[0] if product.colors else ""
+        size = product.sizes[0] if product.sizes else ""
+        line = {"product_id": product.id, "color": color, "size": size}
+
+        self.request("/", "/?from_previous=1")
+        self.request("/set_id", "/set_id", {"participant_id": self.pid}, expect=(302,))
+        self.request("/confirm_id", "/confirm_id")
+        self.request("/index", "/index")
+        self.request("/product/<id>", f"/product/{product.id}")
+        self.request("/add_to_cart", "/add_to_cart", dict(line, quantity=1),
+                     headers={"X-Requested-With": "XMLHttpRequest"})
+        self.request("/cart", "/cart")
+        self.request("/update_cart", "/update_cart", dict(line, quantity=2), expect=(302,))
+        self.request("/confirm", "/confirm")
+        self.request("/complete", "/complete", {}, expect=(302,))
+        self.request("/thanks", "/thanks")
+        self.request("/form_embed", "/form_embed")
+        waiter = None
+        if self.form_time:
+            # 回答している間、画面は完了通知の long-poll を張っている
+            waiter = threading.Thread(target=self.request, args=(
+                "/form_status/<pid>/wait", f"/form_status/{self.pid}/wait?expect=form2"))
+            waiter.start()
+            time.sleep(self.form_time)
+        self.request("/notify_form_submit", "/notify_form_submit",
+                     {"pid": self.pid, "form_id": "form2", "code": FORM2_CODE},
+                     headers={"X-Webhook-Secret": WEBHOOK_SECRET})
+        if waiter is not None:
+            waiter.join()
+        self.request("/guard_to_next", "/guard_to_next", expect=(302,))
+        self.request("/finish", "/finish")
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if len(ordered) < 2:
+        value = ordered[0] * 1000 if ordered else 0.0
+        return {"count": len(ordered), "p50_ms": value, "p95_ms": value, "p99_ms": value}
+    q = statistics.quantiles(ordered, n=100, method="inclusive")
+    return {
+        "count": len(ordered),
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+    }
+
+
+def run(base, args):
+    products = load_products(os.path.join(ROOT, "data", "products.csv"))
+    timings = defaultdict(list)
+    errors = defaultdict(list)
+
+    def worker():
+        for _ in range(args.journeys):
+            Participant(base, products, timings, errors, args.think_time, args.form_time).journey()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.participants)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    req = urllib.request.Request(f"{base}/log_status", headers={"Authorization": f"Bearer {ADMIN_TOKEN}"})
+    with urllib.request.urlopen(req, timeout=10) as res:
+        log_status = json.loads(res.read())
+
+    requests = sum(len(v) for v in timings.values())
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "wall_s": wall,
+        "requests": requests,
+        "journeys": args.participants * args.journeys,
+        "rps": requests / wall if wall else 0.0,
+        "journeys_per_s": args.participants * args.journeys / wall if wall else 0.0,
+        # long-poll は待つのが仕事なので全体の分布には含めない
+        "overall": percentiles([s for route, v in timings.items() if not route.endswith("/wait") for s in v]),
+        "routes": {route: dict(percentiles(samples), errors=len(errors[route]))
+                   for route, samples in timings.items()},
+        "error_samples": {route: [str(s) for s in v[:5]] for route, v in errors.items() if v},
+        "log_status": log_status,
+    }
+
+
+def print_report(result, baseline=None):
+    base_routes = baseline["routes"] if baseline else {}
+    print(f"{'route':22s} {'n':>6s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'err':>5s}"
+          + ("   Δp95" if baseline else ""))
+    for route, r in result["routes"].items():
+        line = (f"{route:22s} {r['count']:6d} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+                f"{r['p99_ms']:8.1f} {r['errors']:5d}")
+        if route in base_routes:
+            line += f" {r['p95_ms'] - base_routes[route]['p95_ms']:+8.1f}"
+        print(line)
+    o = result["overall"]
+    print(f"{'overall':22s} {o['count']:6d} {o['p50_ms']:8.1f} {o['p95_ms']:8.1f} {o['p99_ms']:8.1f}")
+    summary = f"{result['rps']:.1f} req/s, {result['journeys_per_s']:.2f} journeys/s in {result['wall_s']:.1f}s"
+    if baseline:
+        summary += f" (baseline {baseline['rps']:.1f} req/s, {result['rps'] / baseline['rps'] - 1:+.1%})"
+    print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, default=20, help="同時に動く仮想参加者数")
+    parser.add_argument("--journeys", type=int, default=3, help="1スレッドあたりの通し回数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="リクエスト間の最大待ち秒数")
+    parser.add_argument("--form-time", type=float, default=0.0, help="フォーム回答中に long-poll を張る秒数")
+    parser.add_argument("--mode", default="dev", choices=sorted(LAUNCHERS))
+    parser.add_argument("--url", help="起動済みサーバーに対して流す（フェイク Sheets の設定は無視）")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sheets-latency", type=float, default=0.2)
+    parser.add_argument("--quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--out", help="結果 JSON の保存先（既定 benchmarks/results/journey-<時刻>.json）")
+    parser.add_argument("--baseline", help="比較する以前の結果 JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        result = run(args.url.rstrip("/"), args)
+    else:
+        with start_server(args.mode, args.workers, args.threads,
+                          args.sheets_latency, args.quota_error_rate) as base:
+            result = run(base, args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"journey-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""クリックログの集中と報酬コード発行が Sheets のクォータを取り合う状況の再現
+
+FakeQuota（window 秒あたり quota 回を超えると 429）を両シートで共有し、
+ログ（LOW）を --log-rate 行/秒で書きながら /finish 相当（報酬シートの読み直し＋発行）
+を繰り返す。読み直しは本番の 60 秒に当たる window 秒に 1 回。QuotaScheduler
+あり・なしで、発行の所要時間・失敗数・429 の回数・ログの遅れを比べる。
+
+    python -m benchmarks.quota_bench --duration 20 --quota 30 --window 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_wal import EventWAL  # noqa: E402
+from reward_store import RewardStore  # noqa: E402
+from sheet_writer import SheetWriter  # noqa: E402
+from sheets_scheduler import HIGH, LOW, QuotaScheduler  # noqa: E402
+from benchmarks.fake_sheets import FakeQuota, FakeWorksheet  # noqa: E402
+
+ROW = ["2025-01-01 00:00:00", "ABCDEFGHIJKL", "experiment", "カートに追加", 660,
+       "MARURI 全5色 ヒナタマグカップ 350ml", "1", "660", "blue", "", "詳細"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)] if values else 0.0
+
+
+def run(use_scheduler, args):
+    directory = tempfile.mkdtemp(prefix="quota-bench-")
+    quota = FakeQuota(args.quota, args.window)
+    log_ws = FakeWorksheet("sheet1", latency=args.latency, quota=quota)
+    rewards_ws = FakeWorksheet("rewards", latency=args.latency, quota=quota)
+    # 窓を縮めた分だけ分あたりの枠と貯められる回数を合わせる
+    scheduler = QuotaScheduler(per_minute=args.quota * 60 / args.window, burst=args.quota / 4) if use_scheduler else None
+
+    log_writer = SheetWriter(log_ws, name="log", batch_size=args.batch_size, flush_interval=0.05,
+                             max_backoff=args.window, wal=EventWAL(directory, "log"),
+                             scheduler=scheduler, priority=LOW)
+    rewards_writer = SheetWriter(rewards_ws, name="rewards", batch_size=20, flush_interval=0.05,
+                                 max_backoff=args.window, wal=EventWAL(directory, "rewards"),
+                                 scheduler=scheduler, priority=HIGH)
+    store = RewardStore(rewards_ws, writer=rewards_writer, refresh_interval=args.window,
+                        scheduler=scheduler, quota_timeout=args.window / 2)
+    log_writer.start()
+    rewards_writer.start()
+
+    stop = threading.Event()
+
+    def produce():
+        interval = 1.0 / args.log_rate
+        while not stop.is_set():
+            log_writer.enqueue(ROW, pid="P")
+            time.sleep(interval)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    latencies, errors = [], 0
+    deadline = time.monotonic() + args.duration
+    n = 0
+    while time.monotonic() < deadline:
+        n += 1
+        start = time.perf_counter()
+        try:
+            store.get_or_create(f"FIN{n:05d}", "experiment", "experiment")
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        time.sleep(args.finish_interval)
+
+    stop.set()
+    producer.join()
+    backlog = log_writer.pending()
+    log_writer.shutdown(timeout=1)
+    rewards_writer.shutdown(timeout=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "finish_p50_ms": percentile(latencies, 50) * 1000,
+        "finish_p95_ms": percentile(latencies, 95) * 1000,
+        "finish_max_ms": max(latencies) * 1000,
+        "finish_errors": errors,
+        "finishes": len(latencies),
+        "log_rows_written": log_writer.written,
+        "log_backlog": backlog,
+        "log_calls": log_ws.calls,
+        "reward_rows_written": rewards_writer.written,
+        "429s": quota.rejected,
+        "scheduler": scheduler.stats() if scheduler else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--quota", type=int, default=30, help="window 秒あたりの呼び出し上限")
+    parser.add_argument("--window", type=float, default=3.0, help="クォータの窓（本物は 60 秒、短くして時間を縮める）")
+    parser.add_argument("--log-rate", type=float, default=200.0, help="ログの行/秒")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--finish-interval", type=float, default=0.25)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    for use_scheduler in (False, True):
+        result = run(use_scheduler, args)
+        label = "scheduler" if use_scheduler else "no scheduler"
+        print(f"{label:>12}: finish p50 {result['finish_p50_ms']:.1f} ms  p95 {result['finish_p95_ms']:.1f} ms  "
+              f"max {result['finish_max_ms']:.1f} ms  errors {result['finish_errors']}/{result['finishes']}  "
+              f"429s {result['429s']}  log calls {result['log_calls']}  "
+              f"log rows {result['log_rows_written']} (backlog {result['log_backlog']})  "
+              f"reward rows {result['reward_rows_written']}")
+        if result["scheduler"]:
+            print(f"{'':>12}  {result['scheduler']}")
+
+
+if __name__ == "__main__":
+    main()
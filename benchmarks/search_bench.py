@@ -0,0 +1,71 @@
+"""商品検索（search.SearchIndex）の索引構築時間と1クエリあたりの時間
+
+data/products.csv・specs.csv の商品を --scale 倍に複製したカタログで索引を作り、
+代表的なクエリ（語句のみ・語句＋絞り込み・絞り込みのみ）の平均と p99 を測る。
+
+    python -m benchmarks.search_bench --scale 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from dataclasses import replace
+from types import MappingProxyType
+
+from benchmarks.cold_start import ROOT
+
+sys.path.insert(0, ROOT)
+from catalog import CatalogSnapshot, load_products, load_specs  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+QUERIES = [
+    {"query": "マグカップ"},
+    {"query": "電子レンジ 食洗"},
+    {"query": "maruri"},
+    {"query": "陶器", "colors": ["blue", "navy"]},
+    {"query": "陶器", "colors": ["blue", "navy"], "counts": True},
+    {"query": "", "min_price": 700, "max_price": 1500},
+    {"query": "", "colors": ["glass"]},
+    {"query": "存在しない語"},
+]
+
+
+def scaled_snapshot(scale):
+    products = load_products(os.path.join(ROOT, "data", "products.csv"))
+    specs = load_specs(os.path.join(ROOT, "data", "specs.csv"))
+    scaled, scaled_specs = [], {}
+    for n in range(scale):
+        for p in products:
+            pid = f"{p.id}-{n}"
+            scaled.append(replace(p, id=pid, price=p.price + n % 100))
+            scaled_specs[pid] = specs.get(p.id, "")
+    return CatalogSnapshot(1, tuple(scaled), MappingProxyType({p.id: p for p in scaled}),
+                           MappingProxyType(scaled_specs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=500, help="商品を何倍に複製するか")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    snapshot = scaled_snapshot(args.scale)
+    t0 = time.perf_counter()
+    index = SearchIndex(snapshot)
+    build = time.perf_counter() - t0
+    print(f"{len(snapshot.products)} products, {len(index.postings)} grams, build {build * 1000:.0f} ms")
+
+    for params in QUERIES:
+        samples = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            result = index.search(**params)
+            samples.append(time.perf_counter() - t)
+        p99 = statistics.quantiles(samples, n=100)[98]
+        print(f"{str(params):60s} hits {result.total:6d}  mean {statistics.mean(samples) * 1e6:8.1f} us"
+              f"  p99 {p99 * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
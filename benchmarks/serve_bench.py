@@ -0,0 +1,154 @@
+"""開発サーバー（python app.py）と gunicorn（gunicorn.conf.py）のスループット比較
+
+オフラインのフェイク Sheets で起動し、参加者ごとのセッションを持つクライアント
+スレッドが /index・/product/<id>・/cart_count を繰り返し取得する。
+各モードの req/s と p50/p95 レイテンシを表示する。
+
+    python benchmarks/serve_bench.py --clients 32 --duration 10
+    python benchmarks/serve_bench.py --modes gunicorn --workers 4 --threads 8
+"""
+import argparse
+import contextlib
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from benchmarks.cold_start import ROOT, free_port, wait_for
+
+# /log_status などの管理用エンドポイントに使うトークン（--url のときは同じ値をサーバーに設定する）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "bench-admin")
+
+LAUNCHERS = {
+    "dev": """
+import runpy, sys
+sys.path.insert(0, {root!r})
+from benchmarks import fake_sheets
+fake_sheets.install(latency={latency}, quota_error_rate={quota_error_rate})
+runpy.run_path("app.py", run_name="__main__")
+""",
+    "gunicorn": """
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks import fake_sheets
+fake_sheets.install(latency={latency}, quota_error_rate={quota_error_rate})
+from gunicorn.app.wsgiapp import run
+sys.argv = ["gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+run()
+""",
+    # ASGI（asgi.py）。フェイクを入れたプロセスで動かすため 1 プロセスのみ
+    # （uvicorn は WEB_CONCURRENCY をワーカー数として読むので 1 に戻す）
+    "uvicorn": """
+import os, sys
+os.environ["WEB_CONCURRENCY"] = "1"
+sys.path.insert(0, {root!r})
+from benchmarks import fake_sheets
+fake_sheets.install(latency={latency}, quota_error_rate={quota_error_rate})
+import uvicorn
+uvicorn.run("asgi:application", host="127.0.0.1", port=int(os.environ["PORT"]), workers=1, log_level="warning")
+""",
+}
+
+PATHS = ["/index", "/product/001", "/product/002", "/cart_count"]
+
+
+def new_participant(base):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    pid = "".join(random.choices(string.ascii_letters + string.digits, k=12))
+    data = urllib.parse.urlencode({"participant_id": pid}).encode()
+    opener.open(f"{base}/set_id", data=data, timeout=10).read()
+    return opener
+
+
+def client(base, stop, latencies, errors):
+    opener = new_participant(base)
+    while not stop.is_set():
+        path = random.choice(PATHS)
+        t0 = time.perf_counter()
+        try:
+            with opener.open(base + path, timeout=30) as res:
+                res.read()
+            latencies.append(time.perf_counter() - t0)
+        except Exception:
+            errors.append(path)
+
+
+@contextlib.contextmanager
+def start_server(mode, workers=2, threads=8, latency=0.0, quota_error_rate=0.0, env=None):
+    """フェイク Sheets でサーバーを起動し、/healthz が返ったらベース URL を渡す"""
+    port = free_port()
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    env = dict(os.environ, PORT=str(port), WAL_DIR=os.path.join(tmp, "wal"),
+               WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads),
+               FORM_STORE="sqlite", FORM_STORE_PATH=os.path.join(tmp, "form_status.sqlite3"),
+               REWARDS_STORE_PATH=os.path.join(tmp, "rewards.sqlite3"),
+               CART_STORE_PATH=os.path.join(tmp, "carts.sqlite3"),
+               METRICS_DIR=os.path.join(tmp, "metrics"), PROFILE_DIR=os.path.join(tmp, "profiles"),
+               ADMIN_TOKEN=ADMIN_TOKEN, PYTHONUNBUFFERED="1", **(env or {}))
+    code = LAUNCHERS[mode].format(root=ROOT, latency=latency, quota_error_rate=quota_error_rate)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(f"{base}/healthz")
+        yield base
+    finally:
+        proc.terminate()
+        proc.wait(60)
+
+
+def run_mode(mode, args):
+    with start_server(mode, args.workers, args.threads, args.sheets_latency) as base:
+        latencies, errors = [], []
+        stop = threading.Event()
+        threads = [threading.Thread(target=client, args=(base, stop, latencies, errors), daemon=True)
+                   for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join(35)
+
+    ordered = sorted(latencies)
+    q = statistics.quantiles(ordered, n=100) if len(ordered) > 1 else [0.0] * 99
+    return {
+        "mode": mode,
+        "requests": len(ordered),
+        "errors": len(errors),
+        "rps": len(ordered) / args.duration,
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["dev", "gunicorn"], choices=sorted(LAUNCHERS))
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        r = run_mode(mode, args)
+        results.append(r)
+        print(f"{mode:9s} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:6.1f} ms   p95 {r['p95_ms']:6.1f} ms   "
+              f"errors {r['errors']}")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
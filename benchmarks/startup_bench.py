@@ -0,0 +1,81 @@
+"""カタログ読み込みの起動コスト比較（pandas 版 → csv 版）
+
+新しいプロセスで「import + products.csv 読み込み」を行い、
+所要時間と最大 RSS を比べる。pandas が入っていれば結果の一致も確認する。
+
+    python benchmarks/startup_bench.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PANDAS_SNIPPET = """
+import resource, time
+t0 = time.perf_counter()
+import pandas as pd
+df = pd.read_csv("data/products.csv", dtype=str).fillna("")
+records = df.to_dict(orient="records")
+elapsed = time.perf_counter() - t0
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+CSV_SNIPPET = """
+import resource, time
+t0 = time.perf_counter()
+from catalog import Catalog
+Catalog("data/products.csv", "data/specs.csv").snapshot()
+elapsed = time.perf_counter() - t0
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(snippet, runs):
+    times, rss = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, check=True,
+                             capture_output=True, text=True).stdout.split()
+        times.append(float(out[0]))
+        rss.append(int(out[1]))
+    return statistics.median(times), statistics.median(rss)
+
+
+def check_parity():
+    sys.path.insert(0, ROOT)
+    import pandas as pd
+    from catalog import read_csv_records
+
+    path = os.path.join(ROOT, "data", "products.csv")
+    expected = pd.read_csv(path, dtype=str).fillna("").to_dict(orient="records")
+    return expected == read_csv_records(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {"csv": run(CSV_SNIPPET, args.runs)}
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        print("pandas が無いため比較はスキップします")
+    else:
+        results["pandas"] = run(PANDAS_SNIPPET, args.runs)
+        results["parity"] = check_parity()
+
+    for name in ("pandas", "csv"):
+        if name in results:
+            t, rss = results[name]
+            print(f"{name:>6}: import+load {t * 1000:8.1f} ms   max RSS {rss / 1024:6.1f} MB")
+    if "parity" in results:
+        print("records identical:", results["parity"])
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
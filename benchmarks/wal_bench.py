@@ -0,0 +1,63 @@
+"""WAL 追記レイテンシと Sheets へのリプレイ追いつき速度の計測
+
+    python benchmarks/wal_bench.py --events 20000 --latency 0.3
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_wal import EventWAL  # noqa: E402
+from sheet_writer import SheetWriter  # noqa: E402
+from benchmarks.fake_sheets import FakeWorksheet  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.3, help="append_rows 1 回あたりの遅延（秒）")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="wal-bench-")
+    row = ["2025-01-01 00:00:00", "ABCDEFGHIJKL", "experiment", "カートに追加", 660,
+           "MARURI 全5色 ヒナタマグカップ 350ml", "1", "660", "blue", "", "詳細"]
+    try:
+        # 1) ホットパス: Sheets を止めた状態で追記だけ計測
+        wal = EventWAL(directory, "log")
+        writer = SheetWriter(FakeWorksheet(), wal=wal, batch_size=args.batch_size)
+        samples = []
+        for _ in range(args.events):
+            t0 = time.perf_counter()
+            writer.enqueue(row, pid="ABCDEFGHIJKL")
+            samples.append(time.perf_counter() - t0)
+        wal.close()
+        print(f"append: n={len(samples)} mean={statistics.mean(samples) * 1e6:.1f}us "
+              f"p50={percentile(samples, 50) * 1e6:.1f}us p99={percentile(samples, 99) * 1e6:.1f}us")
+
+        # 2) 再起動後のリプレイ: 溜まった分を送り切るまでの時間
+        ws = FakeWorksheet(latency=args.latency)
+        writer = SheetWriter(ws, wal=EventWAL(directory, "log"), batch_size=args.batch_size, flush_interval=0.1)
+        t0 = time.perf_counter()
+        writer.start()
+        writer.flush()
+        elapsed = time.perf_counter() - t0
+        writer.shutdown()
+        print(f"replay: {len(ws.rows)} rows in {elapsed:.2f}s "
+              f"({len(ws.rows) / elapsed:.0f} rows/s, {ws.calls} append_rows calls)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# ---- コンパクト表現 ----
+# カート1行を [商品ID, カラー, サイズ, 数量] で持つ。カラー・サイズは文字列のまま
+# 保存する（colors / sizes 内の位置だと、カタログの再読み込みで並びが変わったときに
+# 別のカラーを指してしまう）。
+
+def _legacy_option(options, value):
+    # 以前の形式（位置の番号。未指定は -1）で保存された行。TTL が過ぎれば無くなる
+    if isinstance(value, int):
+        return options[value] if 0 <= value < len(options) else ""
+    return value or ""
+
+
+def encode_cart(items):
+    return [[item["product_id"], item.get("color", ""), item.get("size", ""), item["quantity"]]
+            for item in items]
+
+
+def decode_cart(snapshot, rows):
+    items = []
+    for product_id, color, size, quantity in rows:
+        if isinstance(color, int) or isinstance(size, int):
+            product = snapshot.get(product_id)
+            color = _legacy_option(product.colors if product else (), color)
+            size = _legacy_option(product.sizes if product else (), size)
+        items.append({
+            "product_id": product_id,
+            "quantity": quantity,
+            "color": color or "",
+            "size": size or "",
+        })
+    return items
+
+
+# ---- 保存先 ----
+
+class CookieCartStore:
+    """従来どおり署名付き Cookie セッションにカートを持つ"""
+
+    def load(self, session, snapshot):
+        return session.get("cart", [])
+
+    def save(self, session, snapshot, items):
+        session["cart"] = items
+
+
+class ServerCartStore:
+    """サーバー側にカートを持ち、セッションには短いカートIDだけを入れる"""
+
+    SESSION_KEY = "cart_sid"
+
+    def _sid(self, session, create=False):
+        sid = session.get(self.SESSION_KEY)
+        if not sid and create:
+            sid = secrets.token_urlsafe(9)
+            session[self.SESSION_KEY] = sid
+        return sid
+
+    def load(self, session, snapshot):
+        sid = self._sid(session)
+        return decode_cart(snapshot, self._get(sid)) if sid else []
+
+    def save(self, session, snapshot, items):
+        sid = self._sid(session, create=bool(items))
+        if sid:
+            self._put(sid, encode_cart(items))
+
+
+class MemoryCartStore(ServerCartStore):
+    """プロセス内に保持（max_carts を超えたら古いものから捨てる）"""
+
+    def __init__(self, max_carts=10000):
+        self.max_carts = max_carts
+        self._lock = threading.Lock()
+        self._carts = OrderedDict()
+
+    def _get(self, sid):
+        with self._lock:
+            rows = self._carts.get(sid)
+            if rows is None:
+                return []
+            self._carts.move_to_end(sid)
+            return list(rows)
+
+    def _put(self, sid, rows):
+        with self._lock:
+            if rows:
+                self._carts[sid] = tuple(tuple(r) for r in rows)
+                self._carts.move_to_end(sid)
+                while len(self._carts) > self.max_carts:
+                    self._carts.popitem(last=False)
+            else:
+                self._carts.pop(sid, None)
+
+
+class SQLiteCartStore(ServerCartStore):
+    """SQLite（WAL モード）に保持。同じマシンの複数ワーカーで共有できる"""
+
+    def __init__(self, path, ttl=24 * 3600, purge_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purged_at = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS carts ("
+            " sid TEXT PRIMARY KEY, items TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 後の子プロセスでは親の接続を使わない
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, sid):
+        row = self._conn().execute(
+            "SELECT items FROM carts WHERE sid = ? AND updated_at >= ?",
+            (sid, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _put(self, sid, rows):
+        now = time.time()
+        conn = self._conn()
+        if rows:
+            conn.execute(
+                "INSERT INTO carts (sid, items, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (sid) DO UPDATE SET items = excluded.items, updated_at = excluded.updated_at",
+                (sid, json.dumps(rows, ensure_ascii=False, separators=(",", ":")), now),
+            )
+        else:
+            conn.execute("DELETE FROM carts WHERE sid = ?", (sid,))
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            conn.execute("DELETE FROM carts WHERE updated_at < ?", (now - self.ttl,))
+
+
+def create_cart_store(backend="cookie", path=os.path.join("data", "carts.sqlite3"), max_carts=10000):
+    if backend == "cookie":
+        return CookieCartStore()
+    if backend == "memory":
+        return MemoryCartStore(max_carts=max_carts)
+    if backend == "sqlite":
+        return SQLiteCartStore(path)
+    raise ValueError(f"unknown cart store backend: {backend}")
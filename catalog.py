@@ -0,0 +1,149 @@
+import csv
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from metrics import timed
+
+
+@dataclass(frozen=True)
+class Product:
+    id: str
+    name: str
+    price: int
+    image: str
+    colors: tuple
+    sizes: tuple
+    detail: str = ""
+    image_source: str = ""
+
+    @property
+    def image_base(self) -> str:
+        # 例: mag_a.jpg → mag_a
+        return self.image.rsplit(".", 1)[0] if self.image else ""
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """ある時点の商品カタログ（読み取り専用）"""
+    version: int
+    products: tuple
+    by_id: MappingProxyType
+    specs: MappingProxyType
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+
+# pandas.read_csv が既定で欠損扱いにする文字列（fillna("") と同じ結果にするため）
+NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+    "n/a", "nan", "null",
+})
+
+
+def read_csv_records(path):
+    """pd.read_csv(path, dtype=str).fillna("").to_dict(orient="records") 相当"""
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        records = []
+        for row in reader:
+            records.append({
+                k: ("" if row.get(k) is None or row[k] in NA_VALUES else row[k])
+                for k in fields
+            })
+    return records
+
+
+def parse_price(value) -> int:
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return 0
+
+
+def load_products(path="data/products.csv"):
+    products = []
+    for row in read_csv_records(path):  # 欠損は空文字
+        products.append(Product(
+            id=row["id"],
+            name=row["name"],
+            price=parse_price(row["price"]),
+            image=row["image"],
+            colors=tuple(row["colors"].split("|")) if row["colors"] else (),
+            sizes=tuple(row["sizes"].split("|")) if row["sizes"] else (),
+            detail=row.get("detail", ""),
+            image_source=row.get("image_source", ""),
+        ))
+    return products
+
+
+def load_specs(path="data/specs.csv"):
+    specs = {}
+    with open(path, encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            # IDをゼロ埋めして確実に一致させる
+            product_id = row["id"].strip().zfill(3)
+            specs[product_id] = row["specs"]
+    return specs
+
+
+class Catalog:
+    """products.csv / specs.csv を一度だけ読み込んで保持するカタログ
+
+    ファイルの mtime が変わったときだけ読み直す。mtime の確認は
+    check_interval 秒に 1 回までに抑える。
+    """
+
+    def __init__(self, products_path="data/products.csv", specs_path="data/specs.csv", check_interval=1.0):
+        self.products_path = products_path
+        self.specs_path = specs_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._checked_at = 0.0
+        self._snapshot = None
+        self.reloads = 0
+
+    def _stat(self):
+        return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else 0
+                     for p in (self.products_path, self.specs_path))
+
+    def _build(self, version):
+        with timed("catalog_load"):
+            products = tuple(load_products(self.products_path))
+            specs = load_specs(self.specs_path) if os.path.exists(self.specs_path) else {}
+        return CatalogSnapshot(
+            version=version,
+            products=products,
+            by_id=MappingProxyType({p.id: p for p in products}),
+            specs=MappingProxyType(specs),
+        )
+
+    def snapshot(self) -> CatalogSnapshot:
+        now = time.monotonic()
+        snap = self._snapshot
+        if snap is not None and now - self._checked_at < self.check_interval:
+            return snap
+        with self._lock:
+            self._checked_at = now
+            mtimes = self._stat()
+            if self._snapshot is None or mtimes != self._mtimes:
+                try:
+                    self._snapshot = self._build(self.reloads + 1)
+                    self._mtimes = mtimes
+                    self.reloads += 1
+                except Exception as e:
+                    # 編集途中の CSV などで失敗したら前回の内容を使い続ける
+                    if self._snapshot is None:
+                        raise
+                    print(f"[catalog] reload failed, keeping version {self._snapshot.version}: {e!r}")
+            return self._snapshot
+
+    def get(self, product_id):
+        return self.snapshot().get(product_id)
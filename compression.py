@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（無ければ gzip だけで応答する）
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/javascript",
+    "application/json", "application/javascript", "image/svg+xml",
+}
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Accept-Encoding を {符号化: q値} にする"""
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate(header: str):
+    """使える符号化のうちクライアントが受け付けるものを返す（br を優先、無ければ None）"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (("br", "gzip") if brotli is not None else ("gzip",))
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class Compressor:
+    """HTML・JSON・CSS などの応答を gzip / brotli で圧縮する
+
+    min_size バイト未満の本文はそのまま返す。強い ETag の付いた応答（描画キャッシュの
+    ページや static のファイル）は同じ本文になりやすいので、本文の blake2b digest
+    （16 バイト）をキーに圧縮結果を cache_bytes まで保持する。
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5, cache_bytes=16 * 1024 * 1024):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def compress(self, body: bytes, encoding: str, cacheable=False) -> bytes:
+        if not cacheable:
+            return self.encode(body, encoding)
+        # 本文の digest で引く（CRC32 では別の本文と衝突して取り違えうる）
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self.encode(body, encoding)
+        with self._lock:
+            self.misses += 1
+            if key not in self._cache:
+                self._cache[key] = data
+                self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and self._cache:
+                _, old = self._cache.popitem(last=False)
+                self._cached_bytes -= len(old)
+        return data
+
+    def should_compress(self, response) -> bool:
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return False
+        if response.is_streamed and not response.direct_passthrough:
+            return False
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return False
+        if "no-transform" in response.headers.get("Cache-Control", ""):
+            return False
+        length = response.content_length
+        return length is None or length >= self.min_size
+
+    def process(self, request, response):
+        """after_request から呼ぶ。圧縮した場合は ETag に符号化を付け、304 も判定する"""
+        if response.mimetype in COMPRESSIBLE_TYPES:
+            response.vary.add("Accept-Encoding")
+        if not self.should_compress(response):
+            return response
+        encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag:
+            # 符号化ごとに別の ETag にする（元の ETag で 304 を返した後なので、ここで改めて判定）
+            encoded_etag = f"{etag}-{encoding}"
+            if request.if_none_match.contains_weak(encoded_etag):
+                not_modified = response.__class__(status=304)
+                not_modified.headers.extend(
+                    (k, v) for k, v in response.headers if k.lower() in ("cache-control", "vary", "last-modified"))
+                not_modified.set_etag(encoded_etag, weak)
+                return not_modified
+
+        # static のファイルは send_file が直接ストリームするので、本文を読み込んでから圧縮する
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+
+        # 弱い ETag の本文（表示ごとに画像を選び直すページ）は同じ本文が来にくいのでキャッシュしない
+        data = self.compress(body, encoding, cacheable=bool(etag) and not weak)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(encoded_etag, weak)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._cache), "bytes": self._cached_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+
+
+COUNTERPART_PINGS = metrics.REGISTRY.counter(
+    "counterpart_pings_total", "Warm-up pings to the counterpart site by outcome")
+COUNTERPART_SECONDS = metrics.REGISTRY.histogram(
+    "counterpart_ping_duration_seconds", "Counterpart warm-up ping latency (includes its cold start)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+
+
+class CounterpartWarmer:
+    """相手サイト（Render のスリープするインスタンス）を先に起こしておく
+
+    poke() は待たずに戻り、別スレッドで base_url + health_path に GET する。
+    直近 min_interval 秒以内に送った・送信中なら何もしない（参加者が何人来ても
+    1回にまとめる。失敗した後は retry_interval 秒で送り直す）。最後に応答が
+    あってから warm_ttl 秒以内なら「起きている」とみなす。
+    state_path を渡すと結果をファイルで共有し、別ワーカーの ping も数に入れる。
+    """
+
+    def __init__(self, base_url, health_path="/healthz", min_interval=60.0, retry_interval=5.0,
+                 warm_ttl=600.0, timeout=90.0, state_path=None):
+        self.url = base_url.rstrip("/") + health_path if base_url else ""
+        self.min_interval = min_interval
+        self.retry_interval = retry_interval
+        self.warm_ttl = warm_ttl
+        self.timeout = timeout
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {"started_at": 0.0, "ok_at": 0.0, "latency": None, "error": ""}
+        self._in_flight = False
+        self.pings = 0
+        self.skipped = 0
+
+    # ---- ワーカー間の共有 ----
+
+    def _load_shared(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for key in ("started_at", "ok_at"):
+                if shared.get(key, 0.0) > self._state[key]:
+                    self._state[key] = shared[key]
+                    if key == "ok_at":
+                        self._state["latency"] = shared.get("latency")
+                        self._state["error"] = ""
+
+    def _save_shared(self):
+        if not self.state_path:
+            return
+        with self._lock:
+            state = dict(self._state)
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"[counterpart] state write failed: {e!r}")
+
+    # ---- ping ----
+
+    def poke(self, reason=""):
+        """必要なら ping を始める（始めたら True）。リクエストの処理は待たせない"""
+        if not self.url:
+            return False
+        self._load_shared()
+        now = time.time()
+        with self._lock:
+            interval = self.retry_interval if self._state["error"] else self.min_interval
+            if self._in_flight or now - self._state["started_at"] < interval:
+                self.skipped += 1
+                return False
+            self._in_flight = True
+            self._state["started_at"] = now
+        self._save_shared()
+        threading.Thread(target=self._ping, args=(reason,), name="counterpart-ping", daemon=True).start()
+        return True
+
+    def _ping(self, reason):
+        start = time.perf_counter()
+        outcome, error = "ok", ""
+        try:
+            response = requests.get(self.url, timeout=(10, self.timeout), headers={"Cache-Control": "no-cache"})
+            if response.status_code >= 500:
+                outcome, error = str(response.status_code), f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            outcome, error = "error", repr(e)
+        latency = time.perf_counter() - start
+        COUNTERPART_PINGS.inc(outcome=outcome)
+        COUNTERPART_SECONDS.observe(latency)
+
+        with self._lock:
+            self.pings += 1
+            self._in_flight = False
+            self._state["latency"] = latency
+            self._state["error"] = error
+            if not error:
+                self._state["ok_at"] = time.time()
+        self._save_shared()
+        print(f"[counterpart] ping ({reason or '-'}) {outcome} in {latency:.2f}s")
+
+    # ---- 状態 ----
+
+    def is_warm(self):
+        if not self.url:
+            return True
+        self._load_shared()
+        with self._lock:
+            return time.time() - self._state["ok_at"] < self.warm_ttl
+
+    def status(self):
+        warm = self.is_warm()
+        with self._lock:
+            state = dict(self._state)
+            in_flight = self._in_flight
+        now = time.time()
+        return {
+            "url": self.url,
+            "warm": warm,
+            "in_flight": in_flight,
+            "last_ok_age": round(now - state["ok_at"], 1) if state["ok_at"] else None,
+            "last_latency": round(state["latency"], 3) if state["latency"] is not None else None,
+            "last_error": state["error"],
+            "pings": self.pings,
+            "skipped": self.skipped,
+        }
@@ -0,0 +1,287 @@
+import fcntl
+import json
+import os
+import threading
+
+
+# 取得したスロットのロック（プロセスが生きている間は開いたままにする）
+_slot_locks = []
+
+
+def _slot_dir(base_dir, i):
+    return base_dir if i == 0 else os.path.join(base_dir, f"worker-{i}")
+
+
+def _try_lock(directory):
+    fd = os.open(os.path.join(directory, "slot.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def acquire_slot(base_dir, max_slots=64):
+    """複数ワーカーが同じ WAL を書かないよう、空いているスロットのディレクトリを返す
+
+    スロット 0 は base_dir そのもの、1 以降は base_dir/worker-N。ロックは
+    プロセス終了時に外れるので、再起動したワーカーが前のプロセスの未送信分を
+    引き継いで送る（ワーカー数が減って使われなくなったスロットの分は
+    drain_orphan_slots で移す）。
+    """
+    for i in range(max_slots):
+        directory = _slot_dir(base_dir, i)
+        os.makedirs(directory, exist_ok=True)
+        fd = _try_lock(directory)
+        if fd is None:
+            continue
+        _slot_locks.append(fd)
+        return directory
+    raise RuntimeError(f"no free WAL slot under {base_dir}")
+
+
+def drain_orphan_slots(base_dir, wals, max_slots=64, chunk=1000):
+    """どのワーカーも使っていないスロットの未送信分を自分の WAL に移す
+
+    wals は {名前: EventWAL}（自分のスロットのもの）。WEB_CONCURRENCY を減らすと
+    番号の大きいスロットはもう誰にも取られないので、起動時にロックが取れた
+    スロットから読み出して追記し、同期してから元の側をコミットする（途中で
+    落ちたら次の起動でもう一度移すので、重複はあっても取りこぼさない）。
+    移した行数を返す。
+    """
+    own = {os.path.abspath(wal.directory) for wal in wals.values()}
+    moved = 0
+    for i in range(max_slots):
+        directory = _slot_dir(base_dir, i)
+        if os.path.abspath(directory) in own or not os.path.isdir(directory):
+            continue
+        fd = _try_lock(directory)
+        if fd is None:
+            continue  # 動いているワーカーのスロット
+        try:
+            files = os.listdir(directory)
+            for name, wal in wals.items():
+                if not any(fn.startswith(f"{name}-") and fn.endswith(".jsonl") for fn in files):
+                    continue
+                orphan = EventWAL(directory, name)
+                try:
+                    while True:
+                        position, records = orphan.read(chunk)
+                        if not records:
+                            break
+                        for record in records:
+                            wal.append(record)
+                        wal.sync()
+                        orphan.commit(position, len(records))
+                        moved += len(records)
+                finally:
+                    orphan.close()
+                # 送り終えたセグメントと位置を消し、空のスロットに戻す
+                for fn in os.listdir(directory):
+                    if fn == f"{name}.offset" or (fn.startswith(f"{name}-") and fn.endswith(".jsonl")):
+                        try:
+                            os.remove(os.path.join(directory, fn))
+                        except OSError:
+                            pass
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+    return moved
+
+
+class EventWAL:
+    """ローカルの追記専用ログ（JSONL セグメント）
+
+    append() はセグメントファイルに 1 行書いて OS に渡すだけで返る。
+    fsync はバックグラウンドでまとめて行う（fsync_interval 秒ごと、または
+    未同期行が fsync_batch 行たまった時点）。送信済みの位置は
+    `<name>.offset` に記録し、それより前のセグメントは削除する。
+    """
+
+    def __init__(self, directory, name, segment_bytes=4 * 1024 * 1024,
+                 fsync_interval=0.2, fsync_batch=64):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._sync_wanted = threading.Event()
+        self._closed = False
+
+        self._offset_path = os.path.join(directory, f"{name}.offset")
+        self._committed = self._load_offset()
+        self.pending = self._count_pending()
+
+        # 再起動時は常に新しいセグメントから書き始める（途中で切れた行を避けるため）
+        segments = self._segments()
+        self._seq = (segments[-1] + 1) if segments else self._committed[0] + 1
+        self._fh = self._open_segment(self._seq)
+        self._unsynced = 0
+        self.appended_total = 0
+        self.fsyncs = 0
+
+        self._syncer = threading.Thread(target=self._sync_loop, name=f"wal-sync-{name}", daemon=True)
+        self._syncer.start()
+
+    # ---- ファイル管理 ----
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{self.name}-{seq:08d}.jsonl")
+
+    def _segments(self):
+        prefix = f"{self.name}-"
+        seqs = []
+        for fn in os.listdir(self.directory):
+            if fn.startswith(prefix) and fn.endswith(".jsonl"):
+                try:
+                    seqs.append(int(fn[len(prefix):-len(".jsonl")]))
+                except ValueError:
+                    continue
+        return sorted(seqs)
+
+    def _open_segment(self, seq):
+        return open(self._segment_path(seq), "ab")
+
+    def _load_offset(self):
+        try:
+            with open(self._offset_path, encoding="utf-8") as f:
+                data = json.load(f)
+            return (int(data["segment"]), int(data["offset"]))
+        except (OSError, ValueError, KeyError):
+            segments = self._segments()
+            return (segments[0] if segments else 0, 0)
+
+    def _save_offset(self, position):
+        tmp = self._offset_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._offset_path)
+
+    def _count_pending(self):
+        return sum(1 for _ in self._iter_from(self._committed))
+
+    # ---- 書き込み ----
+    def append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"WAL {self.name} is closed")
+            self._fh.write(line)
+            self._fh.flush()
+            self._unsynced += 1
+            self.pending += 1
+            self.appended_total += 1
+            if self._fh.tell() >= self.segment_bytes:
+                self._rotate()
+            self._appended.notify_all()
+        if self._unsynced >= self.fsync_batch:
+            self._sync_wanted.set()
+
+    def _rotate(self):
+        # ロック保持中に呼ぶこと
+        self._fsync_locked()
+        self._fh.close()
+        self._seq += 1
+        self._fh = self._open_segment(self._seq)
+
+    def _fsync_locked(self):
+        if self._unsynced:
+            os.fsync(self._fh.fileno())
+            self._unsynced = 0
+            self.fsyncs += 1
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._sync_wanted.wait(self.fsync_interval)
+            self._sync_wanted.clear()
+            with self._lock:
+                if not self._closed:
+                    self._fsync_locked()
+
+    def sync(self):
+        with self._lock:
+            self._fsync_locked()
+
+    # ---- 読み出し・コミット ----
+    def _iter_from(self, position):
+        """position 以降の (次の位置, レコード) を順に返す"""
+        seg, offset = position
+        for seq in self._segments():
+            if seq < seg:
+                continue
+            start = offset if seq == seg else 0
+            try:
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(start)
+                    while True:
+                        line = f.readline()
+                        # 末尾の書きかけ行はまだ読まない
+                        if not line or not line.endswith(b"\n"):
+                            break
+                        start += len(line)
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        yield (seq, start), record
+            except FileNotFoundError:
+                continue
+
+    def read(self, max_records, timeout=None):
+        """未コミットのレコードを最大 max_records 件返す: (位置, [レコード])"""
+        if timeout:
+            self.wait(1, timeout)
+        with self._lock:
+            position = self._committed
+        records = []
+        for position_after, record in self._iter_from(position):
+            records.append(record)
+            position = position_after
+            if len(records) >= max_records:
+                break
+        return position, records
+
+    def wait(self, count, timeout):
+        """未コミットが count 件以上になるか timeout 秒経つまで待つ"""
+        with self._lock:
+            return self._appended.wait_for(lambda: self.pending >= count or self._closed, timeout)
+
+    def commit(self, position, count):
+        with self._lock:
+            self._committed = position
+            self.pending = max(self.pending - count, 0)
+            current = self._seq
+        self._save_offset(position)
+        # 送信済みセグメントを削除（書き込み中のものは残す）
+        for seq in self._segments():
+            if seq < position[0] and seq != current:
+                try:
+                    os.remove(self._segment_path(seq))
+                except OSError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._fsync_locked()
+            self._closed = True
+            self._fh.close()
+            self._appended.notify_all()
+        self._sync_wanted.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "appended": self.appended_total,
+                "fsyncs": self.fsyncs,
+                "segment": self._seq,
+                "committed": list(self._committed),
+            }
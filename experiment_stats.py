@@ -0,0 +1,302 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from form_store import FORM_IDS
+from sheets_scheduler import LOW, sheets_op
+
+
+# ファネルの段階（tools/analytics.py の STEPS に ID 入力・フォーム表示・終了を加えたもの）
+STEPS = ["id", "index", "detail", "add", "cart", "confirm", "purchase", "form", "finish"]
+STEP_ACTIONS = {
+    "id": ("ID入力", "前サイトからのスキップ"),
+    "index": ("条件決定", "商品一覧表示"),
+    "detail": ("商品詳細表示",),           # 「商品詳細表示: 001」は「:」より前で引く
+    "add": ("カートに追加",),
+    "cart": ("カート表示", "カートを見る"),
+    "confirm": ("購入確認画面表示", "確認画面へ進む"),
+    "purchase": ("購入確定",),
+    "form": ("Googleフォーム埋め込み表示",),
+    "finish": ("実験終了",),
+}
+_ACTION_BIT = {action: 1 << i for i, step in enumerate(STEPS) for action in STEP_ACTIONS[step]}
+_FORM_BIT = {form_id: 1 << i for i, form_id in enumerate(FORM_IDS)}
+
+UNKNOWN = "unknown"  # 条件が決まる前（ID 入力直後など）の参加者
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Participant:
+    __slots__ = ("condition", "steps", "forms", "orders")
+
+    def __init__(self):
+        self.condition = UNKNOWN
+        self.steps = 0
+        self.forms = 0
+        self.orders = {}  # 行のキー → (合計金額, 点数)
+
+
+class ExperimentStats:
+    """管理画面用の集計（条件別の人数・ファネル・購入・フォーム完了）
+
+    log_action の行と notify_form_submit の完了通知を受けるたびに、参加者ごとの
+    到達段階（ビット）と購入行を更新し、増えた分だけ条件別の合計を足す（O(1)）。
+    同じ行・同じ完了を何度渡しても数は変わらないので、起動時にシートと WAL から
+    作り直した分とその後の記録が重なってもよい。
+
+    ワーカーごとに参加者の状態を share_dir に書き出し、merged() で和集合を取る
+    （同じ参加者のリクエストが別々のワーカーに届いても二重に数えない）。
+    ログシート全体の読み込み（load_sheet）は1つのワーカーだけが行い、
+    ほかのワーカーはその書き出しを通して見る。
+
+    報酬コードの発行数は RewardStore の発行記録を summary() に渡して数える。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._participants = {}
+        self._totals = {}
+        self.rebuilt_at = None
+        self.rebuild_rows = 0
+        self.rebuild_seconds = None
+        self.last_error = ""
+        self.seeded = False  # ログシートから作り直したか
+        self.share_dir = None
+        self.share_interval = 10.0
+        self.share_ttl = 300.0
+        self._share_pid = None
+        self.workers = 1
+
+    # ---- 更新（すべて O(1)） ----
+
+    def _bucket(self, condition):
+        bucket = self._totals.get(condition)
+        if bucket is None:
+            bucket = self._totals[condition] = {
+                "participants": 0, "steps": [0] * len(STEPS), "forms": [0] * len(FORM_IDS),
+                "orders": 0, "items": 0, "revenue": 0,
+            }
+        return bucket
+
+    def _add(self, bucket, sign, steps, forms, orders):
+        for i in range(len(STEPS)):
+            if steps >> i & 1:
+                bucket["steps"][i] += sign
+        for i in range(len(FORM_IDS)):
+            if forms >> i & 1:
+                bucket["forms"][i] += sign
+        for total, items in orders:
+            bucket["orders"] += sign
+            bucket["items"] += sign * items
+            bucket["revenue"] += sign * total
+
+    def _apply_locked(self, pid, condition, steps=0, forms=0, orders=()):
+        p = self._participants.get(pid)
+        if p is None:
+            p = self._participants[pid] = _Participant()
+            self._bucket(p.condition)["participants"] += 1
+        if condition and condition != p.condition and p.condition == UNKNOWN:
+            # 条件が決まったら、それまでの分を新しい条件に移す
+            old, new = self._bucket(p.condition), self._bucket(condition)
+            old["participants"] -= 1
+            new["participants"] += 1
+            self._add(old, -1, p.steps, p.forms, p.orders.values())
+            self._add(new, 1, p.steps, p.forms, p.orders.values())
+            p.condition = condition
+        added_orders = []
+        for key, total, items in orders:
+            if key not in p.orders:
+                p.orders[key] = (total, items)
+                added_orders.append((total, items))
+        self._add(self._bucket(p.condition), 1, steps & ~p.steps, forms & ~p.forms, added_orders)
+        p.steps |= steps
+        p.forms |= forms
+
+    def observe(self, row):
+        """log_action の行（timestamp, pid, condition, action, total_price, products, quantities, ...）"""
+        if len(row) < 4 or not row[1] or row[1] == "participant_id":
+            return
+        action = str(row[3])
+        bit = _ACTION_BIT.get(action.split(":", 1)[0].strip(), 0)
+        orders = ()
+        if action == "購入確定" and len(row) >= 7:
+            items = sum(_int(q) for q in str(row[6]).split(",") if q)
+            orders = ((f"{row[0]}|{row[4]}|{row[5]}", _int(row[4]), items),)
+        with self._lock:
+            self._apply_locked(str(row[1]), str(row[2] or ""), bit, 0, orders)
+
+    def record_form(self, pid, form_id):
+        bit = _FORM_BIT.get(form_id)
+        if not pid or bit is None:
+            return
+        with self._lock:
+            self._apply_locked(pid, "", 0, bit)
+
+    # ---- 起動時の作り直し ----
+
+    def rebuild(self, rows=(), forms=()):
+        """ログの行と (pid, form_id) の完了記録をまとめて反映する（重なってもよい）"""
+        start = time.perf_counter()
+        count = 0
+        for row in rows:
+            self.observe(row)
+            count += 1
+        for pid, form_id in forms:
+            self.record_form(pid, form_id)
+        with self._lock:
+            self.rebuild_rows += count
+            self.rebuilt_at = time.time()
+            self.rebuild_seconds = time.perf_counter() - start
+        return count
+
+    def load_sheet(self, worksheet, scheduler=None):
+        """ログシート全体を1回だけ読み、集計に反映する（接続後にバックグラウンドで呼ぶ）"""
+        start = time.perf_counter()
+        try:
+            with sheets_op(scheduler, "get_all_values", LOW):
+                rows = worksheet.get_all_values()
+            count = self.rebuild(rows)
+        except Exception as e:
+            self.last_error = repr(e)
+            print(f"[stats] failed to rebuild from the log sheet: {e!r}")
+            return
+        self.last_error = ""
+        self.seeded = True
+        print(f"[stats] rebuilt from {count} log rows in {time.perf_counter() - start:.2f}s")
+
+    # ---- ワーカー間の共有 ----
+
+    def export(self):
+        with self._lock:
+            return {pid: [p.condition, p.steps, p.forms, [[k, t, n] for k, (t, n) in p.orders.items()]]
+                    for pid, p in self._participants.items()}
+
+    def _rebuild_info(self):
+        return {
+            "rows": self.rebuild_rows,
+            "seconds": round(self.rebuild_seconds, 3) if self.rebuild_seconds is not None else None,
+            "at": self.rebuilt_at,
+            "seeded": self.seeded,
+            "last_error": self.last_error,
+        }
+
+    def absorb(self, state):
+        with self._lock:
+            for pid, (condition, steps, forms, orders) in state.items():
+                self._apply_locked(pid, "" if condition == UNKNOWN else condition, steps, forms, orders)
+
+    def start_sharing(self, directory, interval=10.0, ttl=300.0):
+        self.share_dir = directory
+        self.share_interval = interval
+        self.share_ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        if self._share_pid == os.getpid():
+            return
+        self._share_pid = os.getpid()
+        threading.Thread(target=self._share_loop, name="stats-share", daemon=True).start()
+
+    def _share_path(self, pid):
+        return os.path.join(self.share_dir, f"stats-{pid}.json")
+
+    def _share_loop(self):
+        while True:
+            time.sleep(self.share_interval)
+            try:
+                self.write_share()
+            except Exception as e:
+                print(f"[stats] share write failed: {e!r}")
+
+    def write_share(self):
+        if not self.share_dir:
+            return
+        path = self._share_path(os.getpid())
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"participants": self.export(), "rebuild": self._rebuild_info()}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def remove_share(self):
+        if self.share_dir:
+            try:
+                os.remove(self._share_path(os.getpid()))
+            except OSError:
+                pass
+
+    def _peer_states(self):
+        if not self.share_dir:
+            return []
+        own = self._share_path(os.getpid())
+        cutoff = time.time() - self.share_ttl
+        states = []
+        for path in glob.glob(os.path.join(self.share_dir, "stats-*.json")):
+            if path == own:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    continue  # 終了したワーカーの古いファイル
+                with open(path, encoding="utf-8") as f:
+                    state = json.load(f)
+                states.append({"participants": state["participants"], "rebuild": state["rebuild"]})
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        return states
+
+    def merged(self):
+        """他のワーカーの書き出しと合わせた集計（他に無ければ自分をそのまま返す）"""
+        peers = self._peer_states()
+        if not peers:
+            return self
+        merged = ExperimentStats()
+        merged.absorb(self.export())
+        rebuild = self._rebuild_info()
+        for peer in peers:
+            merged.absorb(peer["participants"])
+            if peer["rebuild"]["seeded"] and not rebuild["seeded"]:
+                rebuild = peer["rebuild"]  # シートを読んだワーカーの状況を見せる
+        merged.rebuilt_at = rebuild["at"]
+        merged.rebuild_rows = rebuild["rows"]
+        merged.rebuild_seconds = rebuild["seconds"]
+        merged.seeded = rebuild["seeded"]
+        merged.last_error = rebuild["last_error"]
+        merged.workers = 1 + len(peers)
+        return merged
+
+    # ---- 書き出し ----
+
+    def summary(self, rewarded=()):
+        """rewarded: 報酬コードを発行済みの参加者ID（RewardStore.issued_pids()）"""
+        with self._lock:
+            rewards = {}
+            for pid in rewarded:
+                p = self._participants.get(pid)
+                condition = p.condition if p is not None else None
+                rewards[condition] = rewards.get(condition, 0) + 1
+            conditions = {}
+            for condition, b in sorted(self._totals.items()):
+                if not b["participants"]:
+                    continue
+                conditions[condition] = {
+                    "participants": b["participants"],
+                    "funnel": dict(zip(STEPS, b["steps"])),
+                    "purchases": {"orders": b["orders"], "items": b["items"], "revenue": b["revenue"]},
+                    "forms": dict(zip(FORM_IDS, b["forms"])),
+                    "rewards": rewards.get(condition, 0),
+                }
+            return {
+                "participants": sum(c["participants"] for c in conditions.values()),
+                "conditions": conditions,
+                "steps": list(STEPS),
+                "rewards_issued": sum(rewards.values()),
+                # ログにまだ現れていない参加者への発行（条件が分からない）
+                "rewards_unattributed": rewards.get(None, 0),
+                "workers": self.workers,
+                "rebuild": self._rebuild_info(),
+            }
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+
+FORM_IDS = ("form1", "form2")
+
+
+class MemoryFormStore:
+    """フォーム回答完了の記録（プロセス内の dict。開発用）"""
+
+    def __init__(self, ttl=24 * 3600, purge_interval=300):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._status = {}  # pid → {form_id: 完了時刻}
+        self._purged_at = time.time()
+
+    def mark_done(self, pid: str, form_id: str):
+        if form_id not in FORM_IDS:
+            return
+        now = time.time()
+        with self._lock:
+            self._status.setdefault(pid, {})[form_id] = now
+            if now - self._purged_at >= self.purge_interval:
+                self._purge_locked(now)
+
+    def _purge_locked(self, now):
+        cutoff = now - self.ttl
+        for pid in [p for p, rec in self._status.items() if max(rec.values()) < cutoff]:
+            del self._status[pid]
+        self._purged_at = now
+
+    def get(self, pid: str) -> dict:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rec = self._status.get(pid, {})
+            return {form_id: rec.get(form_id, 0) >= cutoff for form_id in FORM_IDS}
+
+    def is_done(self, pid: str, form_id: str) -> bool:
+        return self.get(pid).get(form_id, False)
+
+    def all_done(self):
+        """期限内の完了記録すべて: [(pid, form_id)]"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return [(pid, form_id) for pid, rec in self._status.items()
+                    for form_id, done_at in rec.items() if done_at >= cutoff]
+
+
+class SQLiteFormStore:
+    """フォーム回答完了の記録（SQLite / WAL モード）
+
+    同じマシン上の複数ワーカープロセスで共有できる。接続はスレッドごとに持つ。
+    ttl 秒より古い記録は見えなくなり、purge_interval 秒ごとに削除する。
+    """
+
+    def __init__(self, path, ttl=24 * 3600, purge_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purged_at = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS form_status ("
+            " pid TEXT NOT NULL, form_id TEXT NOT NULL, done_at REAL NOT NULL,"
+            " PRIMARY KEY (pid, form_id))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS form_status_done_at ON form_status (done_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # fork 後の子プロセスでは親の接続を使わない
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def mark_done(self, pid: str, form_id: str):
+        if form_id not in FORM_IDS:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO form_status (pid, form_id, done_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (pid, form_id) DO UPDATE SET done_at = excluded.done_at",
+            (pid, form_id, now),
+        )
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            conn.execute("DELETE FROM form_status WHERE done_at < ?", (now - self.ttl,))
+
+    def get(self, pid: str) -> dict:
+        rows = self._conn().execute(
+            "SELECT form_id FROM form_status WHERE pid = ? AND done_at >= ?",
+            (pid, time.time() - self.ttl),
+        ).fetchall()
+        done = {row[0] for row in rows}
+        return {form_id: form_id in done for form_id in FORM_IDS}
+
+    def is_done(self, pid: str, form_id: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM form_status WHERE pid = ? AND form_id = ? AND done_at >= ?",
+            (pid, form_id, time.time() - self.ttl),
+        ).fetchone()
+        return row is not None
+
+    def all_done(self):
+        """期限内の完了記録すべて: [(pid, form_id)]"""
+        return self._conn().execute(
+            "SELECT pid, form_id FROM form_status WHERE done_at >= ?",
+            (time.time() - self.ttl,),
+        ).fetchall()
+
+
+class FormWaiters:
+    """回答完了を待つリクエスト用の通知（参加者ID・フォームごとの Event）
+
+    同じプロセスで mark_done されたら notify() ですぐ起こす。別プロセスで
+    記録された場合に備えて recheck 秒ごとにストアも確認する。
+    wait() はスレッドで、wait_async() は asyncio のタスクで待つ（どちらも notify で起きる）。
+
+    wait() は待っている間リクエストのスレッドを占めるので、同時に待てるのは
+    max_threads 本まで。超えた分は待たずに None を返し、呼び出し側は
+    すぐ応答してクライアントに短い間隔で問い合わせ直してもらう。
+    """
+
+    def __init__(self, recheck=1.0, max_threads=None):
+        self.recheck = recheck
+        self.max_threads = max_threads
+        self.threads_waiting = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._events = {}  # (pid, form_id) → [Event, 待機数, [(ループ, asyncio.Event)]]
+
+    def _enter(self, key):
+        with self._lock:
+            entry = self._events.setdefault(key, [threading.Event(), 0, []])
+            entry[1] += 1
+        return entry
+
+    def _leave(self, key, entry):
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] <= 0 and self._events.get(key) is entry:
+                del self._events[key]
+
+    def wait(self, pid: str, form_id: str, check, timeout: float):
+        """完了したら True、timeout 秒で False、待てるスレッドが埋まっていれば None"""
+        if check():
+            return True
+        with self._lock:
+            if self.max_threads is not None and self.threads_waiting >= self.max_threads:
+                self.rejected += 1
+                return None
+            self.threads_waiting += 1
+        key = (pid, form_id)
+        entry = self._enter(key)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if entry[0].wait(min(self.recheck, remaining)) or check():
+                    return True
+        finally:
+            self._leave(key, entry)
+            with self._lock:
+                self.threads_waiting -= 1
+
+    async def wait_async(self, pid: str, form_id: str, check, timeout: float) -> bool:
+        """wait() の asyncio 版。check は await できる関数（ストアの確認はスレッドに逃がす）"""
+        if await check():
+            return True
+        key = (pid, form_id)
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        entry = self._enter(key)
+        with self._lock:
+            entry[2].append((loop, event))
+        try:
+            deadline = loop.time() + timeout
+            while not entry[0].is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(event.wait(), min(self.recheck, remaining))
+                    return True
+                except asyncio.TimeoutError:
+                    pass
+                if await check():
+                    return True
+            return True
+        finally:
+            with self._lock:
+                entry[2].remove((loop, event))
+            self._leave(key, entry)
+
+    def notify(self, pid: str, form_id: str):
+        with self._lock:
+            entry = self._events.get((pid, form_id))
+            waiters = list(entry[2]) if entry else []
+        if entry:
+            entry[0].set()
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # ループが終了済み
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(entry[1] for entry in self._events.values())
+
+
+def create_form_store(backend="sqlite", path=os.path.join("data", "form_status.sqlite3"), ttl=24 * 3600):
+    if backend == "memory":
+        return MemoryFormStore(ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteFormStore(path, ttl=ttl)
+    raise ValueError(f"unknown form store backend: {backend}")
@@ -0,0 +1,54 @@
+"""本番用の gunicorn 設定（render.yaml: gunicorn -c gunicorn.conf.py app:app）
+
+マスターで app を一度だけ読み込み、カタログ・画像一覧・テンプレートを
+温めてから fork する（preload_app）。送信スレッドと WAL はワーカーごとに
+post_fork で開始し、終了時（SIGTERM）は処理中のリクエストを待ってから
+未送信のログを送り切る。
+
+環境変数:
+    PORT              待ち受けポート（既定 10000）
+    WEB_CONCURRENCY   ワーカープロセス数（既定 2）
+    WEB_THREADS       ワーカーあたりのスレッド数（既定 8）
+    FORM_WAIT_THREADS そのうちフォーム回答の long-poll で待たせる上限（既定 WEB_THREADS の半分）
+    GRACEFUL_TIMEOUT  SIGTERM 後に処理中リクエストとログ送信を待つ秒数（既定 30）
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# app は Sheets のクォータをこの数で分け合う（未設定のときも同じ値を見せる）
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("WEB_THREADS", 8))
+# /form_status/<pid>/wait で待たせるスレッド数の既定値（半分）にも使う
+os.environ["WEB_THREADS"] = str(threads)
+worker_class = "gthread"
+preload_app = True
+
+# /form_status/<pid>/wait の long-poll（最大 25 秒）より長くとる
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = os.getenv("ACCESS_LOG") or None
+errorlog = "-"
+
+
+def when_ready(server):
+    # fork 前にマスターで読み込んでおき、ワーカーは copy-on-write で共有する
+    import app
+    app.warm_up()
+    if workers > 1 and os.getenv("CART_STORE", "cookie") == "memory":
+        server.log.warning("CART_STORE=memory はワーカー間で共有されません（sqlite か cookie を使ってください）")
+    if workers > 1 and os.getenv("FORM_STORE", "sqlite") == "memory":
+        server.log.warning("FORM_STORE=memory はワーカー間で共有されません（sqlite を使ってください）")
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_services(warm=False)
+
+
+def worker_exit(server, worker):
+    # 処理中のリクエストが終わった後に呼ばれる。WAL の未送信分を送り切る
+    import app
+    app.stop_background_services(timeout=max(graceful_timeout - 5, 1))
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from metrics import timed
+
+
+# 2枚目以降の共通画像（towel_b_2.jpg ... towel_b_5.jpg）
+GALLERY_RANGE = range(2, 6)
+
+
+@dataclass(frozen=True)
+class ProductImages:
+    """1商品ぶんの画像構成（存在するファイルだけを持つ）"""
+    color_images: MappingProxyType  # カラー → towel_b_sand-beige_1.jpg
+    common: tuple                   # towel_b_2.jpg, towel_b_3.jpg, ...
+    default: str                    # カラー指定なし・画像なしのときに使う1枚
+
+    def color_image(self, color=""):
+        return self.color_images.get(color) or self.default
+
+    def gallery(self, color=""):
+        first = self.color_images.get(color)
+        images = ([first] if first else []) + list(self.common)
+        return images or ([self.default] if self.default else [])
+
+
+EMPTY_IMAGES = ProductImages(MappingProxyType({}), (), "")
+
+
+def build_product_images(product, files):
+    base = product.image_base
+    if not base:
+        return EMPTY_IMAGES
+    color_images = {}
+    for color in product.colors:
+        filename = f"{base}_{color}_1.jpg"
+        if filename in files:
+            color_images[color] = filename
+    common = tuple(f"{base}_{i}.jpg" for i in GALLERY_RANGE if f"{base}_{i}.jpg" in files)
+    # 既定画像: 商品画像 → {base}_1.jpg → 先頭カラー画像 の順で存在するもの
+    default = ""
+    for candidate in (product.image, f"{base}_1.jpg", *color_images.values()):
+        if candidate in files:
+            default = candidate
+            break
+    return ProductImages(MappingProxyType(color_images), common, default)
+
+
+class ImageManifest:
+    """static/images を一度だけ走査して、商品ごとの画像構成を保持する
+
+    ディレクトリの mtime（ファイルの追加・削除で変わる）かカタログの
+    バージョンが変わったときだけ作り直す。確認は check_interval 秒に 1 回まで。
+    """
+
+    def __init__(self, directory=os.path.join("static", "images"), check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._key = None
+        self._checked_at = 0.0
+        self._by_id = MappingProxyType({})
+        self.rebuilds = 0
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _scan(self):
+        try:
+            return frozenset(e.name for e in os.scandir(self.directory) if e.is_file())
+        except OSError:
+            return frozenset()
+
+    def for_catalog(self, snapshot):
+        """カタログのスナップショットに対応する {商品ID: ProductImages} を返す"""
+        now = time.monotonic()
+        key = self._key
+        if key is not None and key[0] == snapshot.version and now - self._checked_at < self.check_interval:
+            return self._by_id
+        with timed("image_scan"), self._lock:
+            self._checked_at = now
+            key = (snapshot.version, self._dir_mtime())
+            if key != self._key:
+                files = self._scan()
+                self._by_id = MappingProxyType({
+                    p.id: build_product_images(p, files) for p in snapshot.products
+                })
+                self._key = key
+                self.rebuilds += 1
+            return self._by_id
+
+    @property
+    def version(self):
+        """最後に作った一覧のキー（カタログ版, ディレクトリ mtime）"""
+        return self._key
+
+    def get(self, snapshot, product_id):
+        return self.for_catalog(snapshot).get(product_id, EMPTY_IMAGES)
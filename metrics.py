@@ -0,0 +1,309 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# 応答時間・外部呼び出し用のバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in items)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """ラベルごとに加算するだけのカウンター"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(map(list, key)), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(into, series):
+        for key, value in series:
+            key = tuple(map(tuple, key))
+            into[key] = into.get(key, 0) + value
+
+    def render(self, merged):
+        lines = []
+        for key, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """固定バケットのヒストグラム（観測1回は bisect と加算だけ）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # ラベル → [バケットごとの件数..., 合計, 件数]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(map(list, key)), list(data)] for key, data in self._values.items()]
+
+    @staticmethod
+    def merge(into, series):
+        for key, data in series:
+            key = tuple(map(tuple, key))
+            current = into.get(key)
+            if current is None or len(current) != len(data):
+                into[key] = list(data)
+            else:
+                into[key] = [a + b for a, b in zip(current, data)]
+
+    def render(self, merged):
+        lines = []
+        for key, data in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録先。Prometheus のテキスト形式で書き出す
+
+    gunicorn の各ワーカーは自分の値を share_dir に定期的に書き出し、
+    /metrics ではそれらを足し合わせて返す（どのワーカーが応答しても全体が見える）。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+        self.share_dir = None
+        self.share_interval = 10.0
+        self.share_ttl = 300.0
+        self._share_thread = None
+        self._share_pid = None
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def gauge_callback(self, name, help_text, fn):
+        """書き出し時に fn() を呼んで値を得るゲージ（{ラベル tuple: 値} か数値を返す）"""
+        self._gauges.append((name, help_text, fn))
+
+    # ---- ワーカー間の共有 ----
+
+    def start_sharing(self, directory, interval=10.0, ttl=300.0):
+        self.share_dir = directory
+        self.share_interval = interval
+        self.share_ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        if self._share_pid == os.getpid():
+            return
+        self._share_pid = os.getpid()
+        self._share_thread = threading.Thread(target=self._share_loop, name="metrics-share", daemon=True)
+        self._share_thread.start()
+
+    def _share_path(self, pid):
+        return os.path.join(self.share_dir, f"metrics-{pid}.json")
+
+    def _share_loop(self):
+        while True:
+            time.sleep(self.share_interval)
+            try:
+                self.write_share()
+            except Exception as e:
+                print(f"[metrics] share write failed: {e!r}")
+
+    def write_share(self):
+        if not self.share_dir:
+            return
+        path = self._share_path(os.getpid())
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def remove_share(self):
+        if self.share_dir:
+            try:
+                os.remove(self._share_path(os.getpid()))
+            except OSError:
+                pass
+
+    def _peer_snapshots(self):
+        if not self.share_dir:
+            return []
+        own = self._share_path(os.getpid())
+        cutoff = time.time() - self.share_ttl
+        snapshots = []
+        for path in glob.glob(os.path.join(self.share_dir, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    continue  # 終了したワーカーの古いファイル
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    # ---- 書き出し ----
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshots = [self.snapshot()] + self._peer_snapshots()
+
+        lines = []
+        for metric in metrics:
+            merged = {}
+            for snap in snapshots:
+                metric.merge(merged, snap.get(metric.name, []))
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged))
+
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"[metrics] gauge {name} failed: {e!r}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            values = value if isinstance(value, dict) else {(): value}
+            for key, v in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "app_request_duration_seconds", "Request handling time by endpoint")
+REQUEST_ERRORS = REGISTRY.counter(
+    "app_request_errors_total", "Requests that raised or returned 5xx, by endpoint")
+FUNCTION_SECONDS = REGISTRY.histogram(
+    "app_function_duration_seconds", "Time spent in instrumented hot-path functions")
+FUNCTION_ERRORS = REGISTRY.counter(
+    "app_function_errors_total", "Exceptions raised by instrumented hot-path functions")
+TEMPLATE_SECONDS = REGISTRY.histogram(
+    "app_template_render_seconds", "render_template time by template")
+RENDER_CACHE = REGISTRY.counter(
+    "app_render_cache_total", "Page render cache lookups by page and result")
+SHEETS_CALLS = REGISTRY.counter(
+    "sheets_api_calls_total", "Google Sheets API calls by operation and outcome")
+SHEETS_SECONDS = REGISTRY.histogram(
+    "sheets_api_duration_seconds", "Google Sheets API call latency by operation")
+
+
+# プロファイル中のリクエストの所要時間の内訳（スレッドごと。start_phases() した間だけ記録する）
+_phases = threading.local()
+
+
+def start_phases():
+    _phases.current = {}
+
+
+def end_phases():
+    current = getattr(_phases, "current", None)
+    _phases.current = None
+    return current or {}
+
+
+def add_phase(name, seconds):
+    current = getattr(_phases, "current", None)
+    if current is not None:
+        current[name] = current.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(function):
+    """with timed("log_action"): ... の所要時間を app_function_duration_seconds に記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        FUNCTION_ERRORS.inc(function=function)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        FUNCTION_SECONDS.observe(elapsed, function=function)
+        add_phase(function, elapsed)
+
+
+@contextmanager
+def sheets_call(op):
+    """Sheets API 呼び出しの回数・結果・所要時間を記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        code = getattr(e, "code", None)
+        SHEETS_CALLS.inc(op=op, outcome=str(code) if code else "error")
+        raise
+    else:
+        SHEETS_CALLS.inc(op=op, outcome="ok")
+    finally:
+        elapsed = time.perf_counter() - start
+        SHEETS_SECONDS.observe(elapsed, op=op)
+        add_phase(f"sheets:{op}", elapsed)
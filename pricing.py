@@ -0,0 +1,55 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class CartLine:
+    product: object
+    quantity: int
+    subtotal: int
+    color: str = ""
+    size: str = ""
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    """カートの集計結果（明細・合計金額・点数）"""
+    items: tuple   # 元のカート行（dict）
+    lines: tuple   # 商品が見つかった行の CartLine
+    total: int
+    count: int     # 全行の数量合計（バッジ表示と同じ）
+
+    @property
+    def names(self):
+        return [line.product.name for line in self.lines]
+
+    @property
+    def quantities(self):
+        return [line.quantity for line in self.lines]
+
+    @property
+    def subtotals(self):
+        return [line.subtotal for line in self.lines]
+
+
+def count_items(cart) -> int:
+    """バッジに出す点数（summarize_cart の count と同じ数え方）"""
+    return sum(item.get('quantity', 0) for item in cart if isinstance(item, dict) and 'product_id' in item)
+
+
+def summarize_cart(snapshot, cart) -> CartSummary:
+    """カートを1回なめて明細・小計・合計・点数を出す（商品は ID で O(1) 参照）"""
+    items = []
+    lines = []
+    total = 0
+    for item in cart:
+        if not isinstance(item, dict) or 'product_id' not in item:
+            continue  # 不正なデータはスキップ
+        items.append(item)
+        quantity = item.get('quantity', 0)
+        product = snapshot.get(item['product_id'])
+        if product:
+            subtotal = product.price * quantity
+            total += subtotal
+            lines.append(CartLine(product, quantity, subtotal,
+                                  item.get("color", ""), item.get("size", "")))
+    return CartSummary(tuple(items), tuple(lines), total, count_items(items))
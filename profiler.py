@@ -0,0 +1,320 @@
+import glob
+import itertools
+import json
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import metrics
+
+
+# _save() が付けるファイル名（<ミリ秒>-<pid>-<連番>.json）
+PROFILE_NAME = re.compile(r"^\d+(-\d+)*\.json$")
+
+
+class RequestProfiler:
+    """リクエスト処理中のスタックを定期的に採取し、遅いリクエストの分を残す
+
+    有効な間は 1 本の採取スレッドが interval 秒ごとに sys._current_frames() から
+    処理中のリクエストのスレッドのスタックを数える（関数呼び出しごとのフックは
+    使わないので、処理そのものはほとんど遅くならない）。
+
+    slow_ms 以上かかったリクエストと、sample_rate の割合で選んだリクエスト・
+    endpoints に挙げたルートのリクエストは、スタックの採取結果と所要時間の内訳
+    （metrics.add_phase で記録したカタログ読み込み・画像の走査・Sheets・描画など）
+    を directory に 1 件 1 ファイルで保存する。capacity 件を超えたら古いものから消す。
+
+    設定は config_path（全ワーカー共通の JSON）で変えられ、check_interval 秒に
+    1 回までファイルの更新を確認する。
+    """
+
+    def __init__(self, directory, config_path, enabled=False, sample_rate=0.0, endpoints=(),
+                 slow_ms=1000.0, interval=0.005, capacity=50, max_depth=64, check_interval=1.0):
+        self.directory = directory
+        self.config_path = config_path
+        self.interval = interval
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.check_interval = check_interval
+        self.defaults = {"enabled": bool(enabled), "sample_rate": float(sample_rate),
+                         "endpoints": sorted(endpoints), "slow_ms": float(slow_ms)}
+        self.config = dict(self.defaults)
+
+        self._lock = threading.Lock()
+        self._active = {}  # スレッド ID → 採取中の _Capture
+        self._sampler_pid = None
+        self._config_mtime = None
+        self._checked_at = 0.0
+        self._seq = itertools.count(1)
+        self.samples_taken = 0
+        self.saved = 0
+
+    # ---- 設定 ----
+
+    def _refresh_config(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._config_mtime:
+            return
+        config = dict(self.defaults)
+        if mtime is not None:
+            try:
+                with open(self.config_path, encoding="utf-8") as f:
+                    config.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"[profiler] failed to read {self.config_path}: {e!r}")
+                return
+        self.config = config
+        self._config_mtime = mtime
+
+    def update_config(self, **changes):
+        """設定を変えて全ワーカーに知らせる（None の項目はそのまま）"""
+        self._checked_at = 0.0
+        self._refresh_config()
+        config = dict(self.config)
+        config.update({k: v for k, v in changes.items() if v is not None})
+        config["endpoints"] = sorted(set(config["endpoints"]))
+        directory = os.path.dirname(self.config_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.config_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        os.replace(tmp, self.config_path)
+        self._checked_at = 0.0
+        self._refresh_config()
+        return dict(self.config)
+
+    # ---- リクエストごと ----
+
+    def begin(self, endpoint):
+        """リクエストの最初に呼ぶ。無効なら None を返す"""
+        self._refresh_config()
+        config = self.config
+        if not config["enabled"]:
+            return None
+        if endpoint in config["endpoints"]:
+            reason = "endpoint"
+        elif config["sample_rate"] and random.random() < config["sample_rate"]:
+            reason = "sampled"
+        else:
+            reason = ""  # 遅かったときだけ残す
+        self._ensure_sampler()
+        capture = _Capture(reason)
+        metrics.start_phases()
+        with self._lock:
+            self._active[threading.get_ident()] = capture
+        return capture
+
+    def end(self, capture, elapsed, **info):
+        """リクエストの最後に呼ぶ。残す条件に当たれば保存する"""
+        if capture is None:
+            return
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        phases = metrics.end_phases()
+        reason = "slow" if elapsed * 1000 >= self.config["slow_ms"] else capture.reason
+        if not reason:
+            return
+        record = dict(info)
+        record.update({
+            "at": time.time(),
+            "reason": reason,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in sorted(phases.items())},
+            "interval": self.interval,
+        })
+        record.update(capture.export())
+        try:
+            self._save(record)
+        except OSError as e:
+            print(f"[profiler] failed to save a profile: {e!r}")
+
+    # ---- スタックの採取 ----
+
+    def _ensure_sampler(self):
+        if self._sampler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sampler_pid == os.getpid():
+                return
+            # fork 後の子プロセスでは自分で採取スレッドを始める
+            self._sampler_pid = os.getpid()
+            self._active = {}
+            threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True).start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                if not self.config["enabled"]:
+                    time.sleep(self.check_interval)
+                continue
+            frames = sys._current_frames()
+            for ident, capture in active:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                capture.add(tuple(reversed(stack)))
+            self.samples_taken += 1
+            del frames
+
+    # ---- 保存・一覧 ----
+
+    def _save(self, record):
+        os.makedirs(self.directory, exist_ok=True)
+        rid = f"{int(record['at'] * 1000)}-{os.getpid()}-{next(self._seq)}"
+        record["id"] = rid
+        path = os.path.join(self.directory, f"{rid}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self.saved += 1
+        # 古いものから消して capacity 件に収める
+        for old in self._paths()[:-self.capacity]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _paths(self):
+        # 自分で保存したファイルだけを古い順に（ほかの *.json は無視する）
+        paths = [p for p in glob.glob(os.path.join(self.directory, "*.json"))
+                 if PROFILE_NAME.match(os.path.basename(p))]
+        return sorted(paths, key=lambda p: tuple(int(x) for x in os.path.basename(p)[:-5].split("-")))
+
+    def records(self):
+        records = []
+        for path in self._paths():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def get(self, rid):
+        """ID で1件（"all" なら残っている全件）"""
+        if rid == "all":
+            return self.records()
+        if not rid.replace("-", "").isdigit():
+            return []
+        try:
+            with open(os.path.join(self.directory, f"{rid}.json"), encoding="utf-8") as f:
+                return [json.load(f)]
+        except (OSError, ValueError):
+            return []
+
+    def stats(self):
+        return {
+            "config": dict(self.config),
+            "interval_ms": self.interval * 1000,
+            "active": len(self._active),
+            "samples_taken": self.samples_taken,
+            "saved": self.saved,
+            "capacity": self.capacity,
+        }
+
+
+class _Capture:
+    """1リクエスト分の採取結果（スタック → 回数）"""
+
+    __slots__ = ("reason", "samples")
+
+    def __init__(self, reason):
+        self.reason = reason
+        self.samples = Counter()
+
+    def add(self, stack):
+        self.samples[stack] += 1
+
+    def export(self):
+        frames, index, samples = [], {}, []
+        for stack, count in self.samples.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append(list(frame))
+                ids.append(index[frame])
+            samples.append([ids, count])
+        return {"frames": frames, "samples": samples, "sample_count": sum(self.samples.values())}
+
+
+# ---- 書き出し形式 ----
+
+def _stacks(records):
+    for record in records:
+        frames = [tuple(f) for f in record["frames"]]
+        for ids, count in record["samples"]:
+            yield [frames[i] for i in ids], count, record["interval"]
+
+
+def _label(frame):
+    filename, line, name = frame
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+
+
+def collapsed(records):
+    """flamegraph.pl / speedscope 用の collapsed stack（"a;b;c 回数" の行）"""
+    totals = Counter()
+    for stack, count, _ in _stacks(records):
+        totals[";".join(_label(f) for f in stack)] += count
+    return "".join(f"{line} {count}\n" for line, count in sorted(totals.items()))
+
+
+def pstats_dump(records):
+    """採取結果を pstats の形式（marshal）にする。snakeviz や pstats.Stats で開ける
+
+    時間は採取回数 × 間隔の推定値で、呼び出し回数は採取で見えた回数。
+    """
+    stats = {}  # (file, line, name) → [cc, nc, tt, ct, {caller: [cc, nc, tt, ct]}]
+
+    def entry(frame):
+        e = stats.get(frame)
+        if e is None:
+            e = stats[frame] = [0, 0, 0.0, 0.0, {}]
+        return e
+
+    for stack, count, interval in _stacks(records):
+        seconds = count * interval
+        seen = set()
+        for depth, frame in enumerate(stack):
+            e = entry(frame)
+            if frame not in seen:  # 再帰しても合計時間は1回分
+                seen.add(frame)
+                e[0] += count
+                e[1] += count
+                e[3] += seconds
+            if depth + 1 == len(stack):
+                e[2] += seconds
+            if depth:
+                edge = e[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[3] += seconds
+                if depth + 1 == len(stack):
+                    edge[2] += seconds
+    return marshal.dumps({
+        frame: (cc, nc, tt, ct, {caller: tuple(v) for caller, v in callers.items()})
+        for frame, (cc, nc, tt, ct, callers) in stats.items()
+    })
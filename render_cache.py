@@ -0,0 +1,98 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+
+
+# 表示のたびに選び直す部分（一覧のカード画像など）の差し込み位置
+SLOT_PREFIX = "__slot__"
+SLOT_PATTERN = re.compile(re.escape(SLOT_PREFIX) + r"([0-9A-Za-z_\-]+?)__")
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8") if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()[:20]
+
+
+def slot(key: str) -> str:
+    return f"{SLOT_PREFIX}{key}__"
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    """描画済みの HTML
+
+    parts は本文と差し込み位置のキーが交互に並ぶ。choices はキーごとの
+    候補（描画済みの HTML 断片）で、fill() のたびにランダムに1つ選ぶ。
+    """
+    parts: tuple
+    choices: MappingProxyType
+    etag: str
+
+    @classmethod
+    def build(cls, html: str, choices=None):
+        choices = {key: tuple(options) for key, options in (choices or {}).items()}
+        etag = make_etag(html, *(f"{key}={option}" for key in sorted(choices) for option in choices[key]))
+        return cls(tuple(SLOT_PATTERN.split(html)), MappingProxyType(choices), etag)
+
+    @property
+    def varies(self) -> bool:
+        """fill() のたびに本文が変わりうるか（ETag は弱いものにする）"""
+        return any(len(options) > 1 for options in self.choices.values())
+
+    def fill(self) -> str:
+        if len(self.parts) == 1:
+            return self.parts[0]
+        out = list(self.parts)
+        for i in range(1, len(out), 2):
+            options = self.choices.get(out[i])
+            out[i] = random.choice(options) if options else ""
+        return "".join(out)
+
+
+class RenderCache:
+    """(テンプレート, 商品ID, 条件, カタログ版, 画像一覧版, 配信用画像版) → RenderedPage
+
+    ユーザーごとに変わる部分（カートのバッジ）は含めない。カタログや
+    画像一覧が変わるとキーが変わるので古い版は参照されなくなり、
+    max_entries を超えた分から捨てる。
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page, True
+        # 描画はロックの外で行う（同時に初回が来たら2回描画しても結果は同じ）
+        result = render()
+        page = RenderedPage.build(*result) if isinstance(result, tuple) else RenderedPage.build(result)
+        with self._lock:
+            self.misses += 1
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page, False
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._pages), "hits": self.hits, "misses": self.misses}
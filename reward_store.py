@@ -0,0 +1,231 @@
+import datetime
+import os
+import secrets
+import sqlite3
+import string
+import threading
+import time
+
+from sheets_scheduler import HIGH, QuotaDeferred, sheets_op
+
+
+# 半角英数7文字（大文字A-Z + 数字0-9）
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LEN = 7
+
+
+def generate_reward_code() -> str:
+    return ''.join(secrets.choice(ALPHABET) for _ in range(CODE_LEN))
+
+
+class RewardStore:
+    """rewards シートを一度読み込み、参加者ID・コードの両方で引ける索引を持つ
+
+    シートの列: timestamp, participant_id, condition, site, reward_code
+    発行時は索引を先に更新してから writer（SheetWriter）経由で追記するので、
+    シートへの反映を待たずに次の照会から見える。
+    別サイト（control-site）が同じシートに書いた分を拾うため、参加者IDが
+    見つからないときは refresh_interval 秒に 1 回までシートを読み直す。
+
+    shared_path を指定すると、発行を SQLite の表（参加者IDが主キー）で確定させる。
+    同じマシンの複数ワーカーが同時に発行しようとしても、先に記録した方のコードを
+    全員が使う。
+
+    scheduler（QuotaScheduler）を渡すと、シートの読み込みは HIGH の枠で行う。
+    quota_timeout 秒待っても枠が空かなければ読み込まずに手元の索引で答える
+    （/finish をクォータ切れで失敗させない）。
+    """
+
+    def __init__(self, worksheet, writer=None, refresh_interval=60.0, shared_path=None,
+                 scheduler=None, quota_timeout=5.0):
+        self.worksheet = worksheet
+        self.writer = writer
+        self.refresh_interval = refresh_interval
+        self.shared_path = shared_path
+        self.scheduler = scheduler
+        self.quota_timeout = quota_timeout
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._by_pid = {}
+        self._codes = set()
+        self._issued = []
+        self._loaded_at = None
+        self._deferred_at = None
+        self.loads = 0
+
+    def _shared(self):
+        if not self.shared_path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        # fork 後の子プロセスでは親の接続を使わない
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.shared_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.shared_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS issued ("
+                " pid TEXT PRIMARY KEY, code TEXT NOT NULL UNIQUE, issued_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _shared_code(self, pid):
+        conn = self._shared()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT code FROM issued WHERE pid = ?", (pid,)).fetchone()
+        return row[0] if row else None
+
+    def _claim(self, pid, code):
+        """共有表に (pid, code) を記録し、その参加者の確定コードを返す（コード衝突時は None）"""
+        conn = self._shared()
+        if conn is None:
+            return code
+        conn.execute("INSERT OR IGNORE INTO issued (pid, code, issued_at) VALUES (?, ?, ?)",
+                     (pid, code, time.time()))
+        return self._shared_code(pid)
+
+    def set_worksheet(self, worksheet):
+        with self._lock:
+            self.worksheet = worksheet
+            self._loaded_at = None  # 次の照会でシートから読み込む
+
+    def _index_row(self, row):
+        if len(row) < 5 or row[0] == "timestamp":
+            return
+        pid, code = row[1], row[4]
+        if code:
+            self._codes.add(code)
+        if pid and code:
+            # 同じIDの行が複数あれば最初に発行されたものを使う
+            self._by_pid.setdefault(pid, code)
+
+    def load(self):
+        # シートの読み込み（ネットワーク・クォータ待ち）は索引のロックの外で行い、
+        # 作り直した索引だけをロック内で差し替える（読み込み中も他の照会・発行は止めない）
+        rows = []
+        fetched = False
+        if self.worksheet is not None:
+            try:
+                with sheets_op(self.scheduler, "get_all_values", HIGH, timeout=self.quota_timeout):
+                    rows = self.worksheet.get_all_values()
+                fetched = True
+            except QuotaDeferred:
+                if self._loaded_at is not None:
+                    raise  # 前回読み込んだ索引をそのまま使う
+                self._deferred_at = time.monotonic()
+                print("[rewards] no Sheets quota left, indexing local rows only")
+        # シート未反映の行（WAL 内の前回分・このプロセスで発行した分）も含める
+        pending = self.writer.pending_rows() if self.writer is not None else []
+        with self._lock:
+            by_pid, codes = self._by_pid, self._codes
+            self._by_pid, self._codes = {}, set()
+            try:
+                for row in list(rows) + list(pending) + list(self._issued):
+                    self._index_row(row)
+            except Exception:
+                self._by_pid, self._codes = by_pid, codes
+                raise
+            if fetched:
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+
+    def _ensure_loaded(self, refresh=False):
+        now = time.monotonic()
+        stale = self._loaded_at is None or (
+            refresh and now - self._loaded_at >= self.refresh_interval)
+        if self._loaded_at is None and self._deferred_at is not None and now - self._deferred_at < self.quota_timeout:
+            stale = False  # 枠が無くて諦めた直後は待ち直さない（手元の索引で答える）
+        if not stale:
+            return
+        # 読み直しは1本だけ。見つからない参加者の照会は読み直しの終わりを待つが、
+        # 索引のロックは持たないので、索引で答えられる照会・発行は止まらない
+        if not self._load_lock.acquire(blocking=self._loaded_at is None or refresh):
+            return
+        try:
+            if self._loaded_at is not None and (
+                    not refresh or time.monotonic() - self._loaded_at < self.refresh_interval):
+                return  # 待っている間に別スレッドが読み込んだ
+            self.load()
+        except Exception as e:
+            if self._loaded_at is None:
+                raise
+            print(f"[rewards] reload failed, using cached index: {e!r}")
+        finally:
+            self._load_lock.release()
+
+    def _lookup(self, pid):
+        with self._lock:
+            code = self._by_pid.get(pid)
+        return code or self._shared_code(pid)
+
+    def find_code(self, pid: str):
+        if not pid:
+            return None
+        self._ensure_loaded()
+        code = self._lookup(pid)
+        if code is None:
+            self._ensure_loaded(refresh=True)
+            with self._lock:
+                code = self._by_pid.get(pid)
+        return code
+
+    def is_code_used(self, code: str) -> bool:
+        self._ensure_loaded()
+        with self._lock:
+            return code in self._codes
+
+    def get_or_create(self, pid: str, condition: str, site_label: str) -> str:
+        existing = self.find_code(pid)
+        if existing:
+            return existing
+
+        # 照会（シートの読み直しを含む）はロックの外。発行の確定は共有表の
+        # INSERT OR IGNORE（参加者ID・コードとも一意）で行い、ロックはこのプロセス内の
+        # 同じ参加者の同時発行と索引の更新だけを守る
+        with self._lock:
+            existing = self._by_pid.get(pid)
+            if existing:
+                return existing
+
+            while True:
+                code = generate_reward_code()
+                if code in self._codes:
+                    continue
+                claimed = self._claim(pid, code) if pid else code
+                if claimed is None:
+                    continue  # 別ワーカーが同じコードを使っていた
+                if claimed != code:
+                    # 別ワーカーが先に発行していた → そちらを使う（シートへはそのワーカーが書く）
+                    self._by_pid[pid] = claimed
+                    self._codes.add(claimed)
+                    return claimed
+                break
+
+            ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            row = [ts, pid, condition, site_label, code]
+            self._index_row(row)
+            self._issued.append(row)
+            if self.writer is not None:
+                self.writer.enqueue(row, pid=pid)
+                return code
+        with sheets_op(self.scheduler, "append_row", HIGH):
+            self.worksheet.append_row(row)
+        return code
+
+    def issued_pids(self):
+        """このサイトで報酬コードを発行した参加者ID（共有表があれば全ワーカー分）"""
+        conn = self._shared()
+        if conn is not None:
+            return [row[0] for row in conn.execute("SELECT pid FROM issued")]
+        with self._lock:
+            return [row[1] for row in self._issued if row[1]]
+
+    def stats(self):
+        with self._lock:
+            return {"participants": len(self._by_pid), "codes": len(self._codes), "loads": self.loads}
@@ -0,0 +1,161 @@
+import heapq
+import operator
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain
+from types import MappingProxyType
+
+
+# 項目ごとの重み（商品名に含まれる語を優先する）
+FIELD_WEIGHTS = (("name", 3.0), ("detail", 1.0), ("specs", 1.0))
+
+
+def normalize_text(text: str) -> str:
+    """全角英数→半角・小文字化し、空白と記号を区切りとして1つの空白にまとめる"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    out = []
+    for ch in text:
+        category = unicodedata.category(ch)
+        out.append(ch if category[0] in "LN" else " ")
+    return " ".join("".join(out).split())
+
+
+def bigrams(text: str):
+    """文字 bigram（空白をまたがない）。1文字だけの語はその1文字を返す"""
+    grams = []
+    for word in text.split():
+        if len(word) == 1:
+            grams.append(word)
+        else:
+            grams.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    ids: tuple
+    total: int
+    facets: dict
+
+
+class SearchIndex:
+    """1つのカタログ版に対する検索索引（構築後は読み取り専用）
+
+    postings: bigram → {商品の位置: 重み付き出現数}。1文字の語のために unigram も持つ。
+    color / size は値 → 商品位置の frozenset、価格は位置ごとの配列で持つ。
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.products = snapshot.products
+        self.ids = tuple(p.id for p in self.products)
+        self.prices = tuple(p.price for p in self.products)
+        self.colors_at = tuple(p.colors for p in self.products)
+        self.sizes_at = tuple(p.sizes for p in self.products)
+
+        postings = {}
+        for i, product in enumerate(self.products):
+            fields = {"name": product.name, "detail": product.detail, "specs": snapshot.specs.get(product.id, "")}
+            for field, weight in FIELD_WEIGHTS:
+                text = normalize_text(fields[field])
+                grams = bigrams(text) + [ch for ch in text if ch != " "]
+                for gram in grams:
+                    entry = postings.setdefault(gram, {})
+                    entry[i] = entry.get(i, 0.0) + weight
+        self.postings = MappingProxyType(postings)
+
+        self.by_color = self._facet(lambda p: p.colors)
+        self.by_size = self._facet(lambda p: p.sizes)
+        self.all_positions = frozenset(range(len(self.products)))
+        prices = [p for p in self.prices if p > 0]
+        self.facets = {
+            "colors": sorted(self.by_color),
+            "sizes": sorted(self.by_size),
+            "price_min": min(prices) if prices else 0,
+            "price_max": max(prices) if prices else 0,
+        }
+
+    def _facet(self, values):
+        facet = {}
+        for i, product in enumerate(self.products):
+            for value in values(product):
+                facet.setdefault(value, set()).add(i)
+        return MappingProxyType({k: frozenset(v) for k, v in facet.items()})
+
+    def _match(self, query):
+        """クエリの bigram をすべて含む商品の位置と、位置ごとのスコア（クエリが空なら None）"""
+        grams = list(dict.fromkeys(bigrams(normalize_text(query))))
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            entry = self.postings.get(gram)
+            if not entry:
+                return {}
+            lists.append(entry)
+        lists.sort(key=len)
+        common = set(lists[0]).intersection(*lists[1:])
+        return common, lists
+
+    def search(self, query="", colors=(), sizes=(), min_price=None, max_price=None, limit=50, counts=False):
+        """ランク順の商品IDを返す。counts=True なら絞り込み後の色・サイズ別件数も数える"""
+        matched = self._match(query)
+        if matched == {}:
+            positions = set()
+        elif matched is None:
+            positions = set(self.all_positions)
+        else:
+            positions = matched[0]
+
+        # 同じ項目内は OR（どれかの色）、項目間は AND
+        if colors:
+            positions &= frozenset().union(*(self.by_color.get(c, frozenset()) for c in colors))
+        if sizes:
+            positions &= frozenset().union(*(self.by_size.get(s, frozenset()) for s in sizes))
+        if min_price is not None or max_price is not None:
+            lo = min_price if min_price is not None else float("-inf")
+            hi = max_price if max_price is not None else float("inf")
+            prices = self.prices
+            positions = {i for i in positions if lo <= prices[i] <= hi}
+
+        positions = list(positions)
+        if not matched:
+            top = sorted(positions)[:limit]
+        else:
+            # スコアの合計は項目ごとの dict 引きを map でまとめて行う（Python の for を回さない）
+            lists = matched[1]
+            totals = list(map(lists[0].__getitem__, positions))
+            for entry in lists[1:]:
+                totals = list(map(operator.add, totals, map(entry.__getitem__, positions)))
+            # スコアの高い順、同点はカタログの並び順
+            best = heapq.nlargest(limit, zip(totals, map(operator.neg, positions)))
+            top = [-neg for _, neg in best]
+
+        facets = {}
+        if counts:
+            facets = {
+                "colors": dict(Counter(chain.from_iterable(map(self.colors_at.__getitem__, positions)))),
+                "sizes": dict(Counter(chain.from_iterable(map(self.sizes_at.__getitem__, positions)))),
+            }
+        return SearchResult(ids=tuple(map(self.ids.__getitem__, top)), total=len(positions), facets=facets)
+
+
+class ProductSearch:
+    """カタログ版ごとに索引を1回だけ作る（版が変わったら作り直す）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self.builds = 0
+
+    def for_catalog(self, snapshot) -> SearchIndex:
+        index = self._index
+        if index is not None and index.version == snapshot.version:
+            return index
+        with self._lock:
+            if self._index is None or self._index.version != snapshot.version:
+                self._index = SearchIndex(snapshot)
+                self.builds += 1
+            return self._index
@@ -0,0 +1,333 @@
+import atexit
+import queue
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+from event_wal import EventWAL
+from sheets_scheduler import LOW, sheets_op
+
+
+# リトライ対象とする HTTP ステータス（429: クォータ超過, 5xx: 一時的な障害）
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, APIError):
+        return getattr(e, "code", None) in RETRYABLE_STATUS
+    # ネットワーク系の例外（タイムアウト・切断など）も再試行する
+    return isinstance(e, (ConnectionError, TimeoutError, OSError))
+
+
+class SheetWriter:
+    """ワークシートへの追記をバックグラウンドでまとめて行うライター
+
+    enqueue() は行をキューに積んですぐ返る。ワーカースレッドが
+    batch_size 行たまるか flush_interval 秒経過するごとに append_rows で
+    一括送信し、クォータ超過時は指数バックオフで再試行する。
+
+    wal（EventWAL）を渡した場合はメモリ上のキューの代わりに WAL に追記し、
+    ワーカーは WAL の未コミット分を読み出して送信・コミットする。
+    この場合は Sheets が落ちていても行は失われず、再起動後に続きから送られる。
+    再試行しても通らない（400 など）バッチは半分ずつ送り直して原因の行を絞り込み、
+    その行だけを同じディレクトリの `<name>.dead` WAL に移してからコミットする。
+
+    worksheet は後から set_worksheet() で渡してもよい。それまでは送信せずにためておく。
+
+    scheduler（QuotaScheduler）を渡すと、送信のたびに priority の枠を取ってから
+    append_rows する。枠を待っていた間にたまった行は max_batch 行まで同じ
+    呼び出しにまとめる（クォータが足りないときは遅れる代わりに回数が減る）。
+    """
+
+    def __init__(self, worksheet, name="log", maxsize=10000, batch_size=100,
+                 flush_interval=2.0, max_backoff=60.0, wal=None,
+                 scheduler=None, priority=LOW, max_batch=1000):
+        self.worksheet = worksheet
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.wal = wal
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_batch = max(max_batch, batch_size)
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._current = []
+        self._ws_ready = threading.Event()
+        if worksheet is not None:
+            self._ws_ready.set()
+
+        # 参加者IDごとの送信待ち行数
+        self._in_flight = {}
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.retries = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self._dead = None
+        self.last_error = ""
+        self.last_flush_at = None
+        self.coalesced = 0
+
+        if wal is not None:
+            # 前回の未送信分も送信待ちとして数える
+            _, records = wal.read(max_records=wal.pending or 1)
+            for record in records:
+                self._count_in(record.get("pid", ""))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"sheet-writer-{self.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def set_worksheet(self, worksheet):
+        self.worksheet = worksheet
+        self._ws_ready.set()
+
+    def _count_in(self, pid):
+        if pid:
+            self._in_flight[pid] = self._in_flight.get(pid, 0) + 1
+
+    def enqueue(self, row, pid=""):
+        if self.wal is not None:
+            self.wal.append({"pid": pid, "row": row})
+        else:
+            try:
+                self._queue.put_nowait((pid, row))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                print(f"[{self.name}] queue full, dropped row: {row[:4]}")
+                return False
+        with self._lock:
+            self.enqueued += 1
+            self._count_in(pid)
+        return True
+
+    def _collect_batch(self, timeout):
+        """(コミット位置, [(pid, row)]) を返す"""
+        if self.wal is not None:
+            # batch_size 行たまるか timeout まで待ってからまとめて読む
+            if not self._stop.is_set():
+                self.wal.wait(self.batch_size, timeout)
+            position, records = self.wal.read(self.batch_size)
+            return position, [(r.get("pid", ""), r.get("row", [])) for r in records]
+
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # 期限切れ後もすでにキューにある分はまとめて持っていく
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return None, batch
+
+    def _admit(self):
+        """送信の枠を取る。取れるまで待った秒数を返す（WAL があって停止要求が来たら None）"""
+        start = time.monotonic()
+        while not self.scheduler.acquire(self.priority, timeout=0.5):
+            if self._stop.is_set() and self.wal is not None:
+                return None
+        return time.monotonic() - start
+
+    def _top_up(self, position, batch):
+        """枠を待っている間に増えた行を max_batch 行まで同じバッチに加える"""
+        if self.wal is not None:
+            # WAL はコミット位置から読み直せば今のバッチを含む
+            position, records = self.wal.read(self.max_batch)
+            grown = [(r.get("pid", ""), r.get("row", [])) for r in records]
+        else:
+            grown = list(batch)
+            while len(grown) < self.max_batch:
+                try:
+                    grown.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        if len(grown) > len(batch):
+            with self._lock:
+                self.coalesced += len(grown) - len(batch)
+        return position, grown
+
+    def _send(self, batch, admitted=False):
+        rows = [row for _, row in batch]
+        delay = 1.0
+        while True:
+            try:
+                with sheets_op(self.scheduler, "append_rows", self.priority, acquired=admitted):
+                    self.worksheet.append_rows(rows)
+                break
+            except Exception as e:
+                admitted = False  # 再試行では改めて枠を取る
+                self.last_error = repr(e)
+                if not self._should_retry(e, delay):
+                    with self._lock:
+                        self.failed_batches += 1
+                    print(f"[{self.name}] append_rows failed ({len(rows)} rows): {e!r}")
+                    return False
+                with self._lock:
+                    self.retries += 1
+                wait = delay + random.uniform(0, delay / 2)
+                if self.wal is not None:
+                    self._stop.wait(wait)
+                    delay = min(delay * 2, self.max_backoff)
+                else:
+                    # 停止要求中でもクォータ待ちは続ける（行を失わないため）
+                    time.sleep(wait)
+                    delay *= 2
+
+        with self._lock:
+            self.written += len(rows)
+            self.last_flush_at = time.time()
+        return True
+
+    def _send_or_isolate(self, batch, admitted=False):
+        """送れなかったバッチを二分して送り直す。1行でも通らない行は dead letter に移す
+
+        停止要求で送れなかったときだけ False（WAL に残して次回起動時に送る）。
+        """
+        if self._send(batch, admitted):
+            return True
+        if self.wal is None or self._stop.is_set():
+            return False
+        if len(batch) == 1:
+            self._dead_letter(batch)
+            return True
+        mid = len(batch) // 2
+        return self._send_or_isolate(batch[:mid]) and self._send_or_isolate(batch[mid:])
+
+    def _dead_letter(self, batch):
+        if self._dead is None:
+            self._dead = EventWAL(self.wal.directory, f"{self.name}.dead")
+        for pid, row in batch:
+            self._dead.append({"pid": pid, "row": row, "error": self.last_error, "at": time.time()})
+        self._dead.sync()
+        with self._lock:
+            self.dead_lettered += len(batch)
+        print(f"[{self.name}] moved {len(batch)} rejected row(s) to {self.name}.dead: {batch[0][1][:4]}")
+
+    def _should_retry(self, e, delay):
+        if self.wal is not None:
+            # WAL があれば行は失われないので、不正リクエスト(400)以外は上限なしで再試行する
+            return not self._stop.is_set() and getattr(e, "code", None) != 400
+        return is_retryable(e) and delay <= self.max_backoff
+
+    def _done(self, batch):
+        with self._lock:
+            for pid, _ in batch:
+                if not pid:
+                    continue
+                left = self._in_flight.get(pid, 0) - 1
+                if left > 0:
+                    self._in_flight[pid] = left
+                else:
+                    self._in_flight.pop(pid, None)
+            self._current = []
+        if self.wal is None:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self):
+        # 接続が確立するまでは送らずにためておく
+        while not self._ws_ready.wait(0.5):
+            if self._stop.is_set():
+                return
+        while not (self._stop.is_set() and self.pending() == 0):
+            position, batch = self._collect_batch(self.flush_interval)
+            if not batch:
+                continue
+            admitted = False
+            if self.scheduler is not None:
+                waited = self._admit()
+                if waited is None:
+                    break  # 未送信分は WAL に残して次回起動時に送る
+                admitted = True
+                if waited > 0.05:
+                    position, batch = self._top_up(position, batch)
+            with self._lock:
+                self._current = batch
+            sent = self._send_or_isolate(batch, admitted)
+            if self.wal is not None:
+                if not sent and self._stop.is_set():
+                    # 停止中に送れなかった分は WAL に残して次回起動時に送る
+                    break
+                self.wal.commit(position, len(batch))
+            self._done(batch)
+
+    def flush(self, timeout=None):
+        """送信待ちがなくなるまで待つ（timeout 秒で打ち切り）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self, timeout=30.0):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self.wal is not None:
+            self.wal.close()
+        if self._dead is not None:
+            self._dead.close()
+
+    def pending(self, pid=None):
+        with self._lock:
+            if pid is not None:
+                return self._in_flight.get(pid, 0)
+            if self.wal is not None:
+                return self.wal.pending
+            return self._queue.unfinished_tasks
+
+    def pending_rows(self):
+        """まだシートに書かれていない行の一覧（送信中のバッチを含む）"""
+        if self.wal is not None:
+            _, records = self.wal.read(max_records=max(self.wal.pending, 1))
+            return [r.get("row", []) for r in records]
+        with self._lock:
+            current = [row for _, row in self._current]
+        with self._queue.mutex:
+            queued = [row for _, row in self._queue.queue]
+        return current + queued
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "queue_depth": self._queue.qsize(),
+                "in_flight": self._queue.unfinished_tasks,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "retries": self.retries,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+                "coalesced": self.coalesced,
+                "last_error": self.last_error,
+                "last_flush_at": self.last_flush_at,
+            }
+        if self.wal is not None:
+            wal_stats = self.wal.stats()
+            stats["queue_depth"] = stats["in_flight"] = wal_stats["pending"]
+            stats["wal"] = wal_stats
+        return stats
@@ -0,0 +1,141 @@
+import base64
+import json
+import threading
+import time
+
+import gspread
+from google.oauth2.service_account import Credentials
+from gspread.exceptions import WorksheetNotFound
+
+from metrics import sheets_call
+from sheets_scheduler import HIGH, sheets_op
+from sheets_transport import SheetsTransport
+
+
+REWARDS_HEADER = ["timestamp", "participant_id", "condition", "site", "reward_code"]
+
+
+class SheetsBackend:
+    """Google Sheets への接続をバックグラウンドで確立する
+
+    import 時にはネットワークに出ず、start() したスレッドで認証・シート取得を行う。
+    失敗したら指数バックオフで再試行し続ける。準備ができたら on_ready に
+    登録したコールバックへ (worksheet, rewards_ws) を渡す。
+
+    HTTP は SheetsTransport（pool_size 本のキープアライブ接続・トークンの
+    バックグラウンド更新）を通す。timeout は (接続, 読み取り) 秒。
+    scheduler を渡すと、シートの取得も HIGH の枠で行う。
+    """
+
+    def __init__(self, service_account_path, spreadsheet_id, scopes, max_backoff=60.0,
+                 pool_size=10, timeout=(10, 60), scheduler=None):
+        self.service_account_path = service_account_path
+        self.spreadsheet_id = spreadsheet_id
+        self.scopes = scopes
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.scheduler = scheduler
+
+        self.transport = None
+        self.gc = None
+        self.worksheet = None
+        self.rewards_ws = None
+        self.ready = threading.Event()
+        self.state = "idle"
+        self.last_error = ""
+        self.attempts = 0
+        self.started_at = None
+        self.ready_at = None
+        self._callbacks = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def on_ready(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+            ready = self.ready.is_set()
+        if ready:
+            callback(self.worksheet, self.rewards_ws)
+
+    def start(self, warm_up=None):
+        if self._thread and self._thread.is_alive():
+            return
+        self.started_at = time.time()
+        self.state = "starting"
+        self._thread = threading.Thread(target=self._run, args=(warm_up,), name="sheets-startup", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        with open(self.service_account_path, 'r') as f:
+            encoded = f.read()
+        service_info = json.loads(base64.b64decode(encoded).decode('utf-8'))
+        credentials = Credentials.from_service_account_info(service_info, scopes=self.scopes)
+        transport = SheetsTransport(credentials, pool_size=self.pool_size)
+        try:
+            # 最初のトークンはここで取得し、以降は期限前に更新スレッドが取り直す
+            with sheets_call("authorize"):
+                transport.start()
+                gc = gspread.authorize(credentials, session=transport.session)
+            gc.set_timeout(self.timeout)
+
+            with sheets_op(self.scheduler, "open_by_key", HIGH):
+                sh = gc.open_by_key(self.spreadsheet_id)
+            worksheet = sh.sheet1
+            try:
+                with sheets_op(self.scheduler, "worksheet", HIGH):
+                    rewards_ws = sh.worksheet('rewards')
+            except WorksheetNotFound:
+                with sheets_op(self.scheduler, "add_worksheet", HIGH):
+                    rewards_ws = sh.add_worksheet(title='rewards', rows=1000, cols=10)
+                    rewards_ws.append_row(REWARDS_HEADER)
+        except Exception:
+            transport.stop()
+            raise
+        return transport, gc, worksheet, rewards_ws
+
+    def _run(self, warm_up):
+        if warm_up is not None:
+            try:
+                warm_up()
+            except Exception as e:
+                print(f"[startup] warm-up failed: {e!r}")
+
+        delay = 1.0
+        while True:
+            self.attempts += 1
+            try:
+                transport, gc, worksheet, rewards_ws = self._connect()
+                break
+            except Exception as e:
+                self.state = "retrying"
+                self.last_error = repr(e)
+                print(f"[startup] Sheets connection failed (attempt {self.attempts}): {e!r}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+        with self._lock:
+            self.transport, self.gc, self.worksheet, self.rewards_ws = transport, gc, worksheet, rewards_ws
+            self.state = "ready"
+            self.ready_at = time.time()
+            self.ready.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback(worksheet, rewards_ws)
+            except Exception as e:
+                print(f"[startup] on_ready callback failed: {e!r}")
+        print(f"[startup] Sheets ready in {self.ready_at - self.started_at:.2f}s")
+
+    def wait_ready(self, timeout=None) -> bool:
+        return self.ready.wait(timeout)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.ready.is_set(),
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "startup_seconds": (self.ready_at - self.started_at) if self.ready_at and self.started_at else None,
+            "transport": self.transport.stats() if self.transport else None,
+        }
@@ -0,0 +1,132 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from metrics import sheets_call
+
+
+# 優先度（報酬コードの読み書き・起動時のシート取得 > クリックログの追記）
+HIGH = "high"
+LOW = "low"
+
+SCHEDULER_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "sheets_scheduler_wait_seconds", "Time Sheets calls waited for quota budget, by priority")
+SCHEDULER_DEFERRED = metrics.REGISTRY.counter(
+    "sheets_scheduler_deferred_total", "Sheets calls refused because no budget was available in time")
+SCHEDULER_THROTTLED = metrics.REGISTRY.counter(
+    "sheets_scheduler_throttled_total", "429 responses that made the scheduler cut its rate")
+
+
+class QuotaDeferred(Exception):
+    """timeout 秒以内に枠が空かなかった（呼び出し側は手元の情報で続ける）"""
+
+
+class QuotaScheduler:
+    """Sheets API の分あたりクォータを配分するトークンバケット
+
+    per_minute 回/分の割合で補充し、burst 回まで貯められる。HIGH の呼び出しが
+    待っている間は LOW に渡さず、LOW は reserve 回分を HIGH のために残す。
+    429 が返ったら実際の残りが無いとみなして空にし、補充の速さを半分にする
+    （成功するたびに少しずつ per_minute まで戻す）。同じクォータを使う別の
+    ワーカー・別サイトがあっても、429 を手がかりに実際の枠に合わせる。
+    """
+
+    def __init__(self, per_minute=60.0, burst=None, reserve=None, min_per_minute=6.0):
+        self.per_minute = float(per_minute)
+        self.min_per_minute = min(float(min_per_minute), self.per_minute)
+        self.burst = float(burst) if burst is not None else max(self.per_minute / 4, 2.0)
+        self.reserve = float(reserve) if reserve is not None else max(self.burst / 5, 1.0)
+        self._cond = threading.Condition()
+        self._rate = self.per_minute / 60.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._high_waiting = 0
+        self.granted = {HIGH: 0, LOW: 0}
+        self.deferred = 0
+        self.throttled = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _floor(self, priority):
+        return 1.0 if priority == HIGH else 1.0 + self.reserve
+
+    def acquire(self, priority=LOW, timeout=None) -> bool:
+        """1回分の枠を取る（timeout 秒待っても取れなければ False）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        start = time.perf_counter()
+        with self._cond:
+            if priority == HIGH:
+                self._high_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    floor = self._floor(priority)
+                    if self._tokens >= floor and (priority == HIGH or not self._high_waiting):
+                        self._tokens -= 1.0
+                        self.granted[priority] += 1
+                        break
+                    wait = (floor - self._tokens) / self._rate if self._tokens < floor else 0.5
+                    if deadline is not None:
+                        if now >= deadline:
+                            self.deferred += 1
+                            SCHEDULER_DEFERRED.inc(priority=priority)
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(max(wait, 0.001))
+            finally:
+                if priority == HIGH:
+                    self._high_waiting -= 1
+                    self._cond.notify_all()
+        waited = time.perf_counter() - start
+        SCHEDULER_WAIT_SECONDS.observe(waited, priority=priority)
+        metrics.add_phase("sheets_quota_wait", waited)
+        return True
+
+    def on_success(self):
+        with self._cond:
+            self._rate = min(self._rate + self.per_minute / 60.0 / 20, self.per_minute / 60.0)
+
+    def on_throttled(self):
+        with self._cond:
+            self.throttled += 1
+            self._tokens = min(self._tokens, 0.0)
+            self._rate = max(self._rate / 2, self.min_per_minute / 60.0)
+        SCHEDULER_THROTTLED.inc()
+
+    @contextmanager
+    def call(self, op, priority=LOW, timeout=None, acquired=False):
+        """枠を取ってから Sheets API を呼ぶ（acquired=True なら取得済み）。429 なら速さを落とす"""
+        if not acquired and not self.acquire(priority, timeout):
+            raise QuotaDeferred(op)
+        try:
+            with sheets_call(op):
+                yield
+        except Exception as e:
+            if getattr(e, "code", None) == 429:
+                self.on_throttled()
+            raise
+        else:
+            self.on_success()
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "tokens": round(self._tokens, 2),
+                "per_minute": round(self._rate * 60, 1),
+                "configured_per_minute": self.per_minute,
+                "granted": dict(self.granted),
+                "deferred": self.deferred,
+                "throttled": self.throttled,
+            }
+
+
+def sheets_op(scheduler, op, priority=LOW, timeout=None, acquired=False):
+    """scheduler があればそれを通し、無ければ計測だけして呼ぶ"""
+    if scheduler is None:
+        return sheets_call(op)
+    return scheduler.call(op, priority, timeout, acquired)
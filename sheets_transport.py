@@ -0,0 +1,208 @@
+import datetime
+import ipaddress
+import socket
+import threading
+import time
+
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+import metrics
+
+
+SHEETS_TRANSPORT_SECONDS = metrics.REGISTRY.histogram(
+    "sheets_transport_duration_seconds",
+    "Time spent outside the API call itself: DNS, TCP connect, TLS handshake and token refresh")
+SHEETS_CONNECTIONS = metrics.REGISTRY.counter(
+    "sheets_connections_total", "New HTTPS connections opened to Google APIs (reused ones are not counted)")
+SHEETS_TOKEN_REFRESHES = metrics.REGISTRY.counter(
+    "sheets_token_refreshes_total", "Access token refreshes by source (background / inline) and outcome")
+
+# 切れていない接続を OS にも確認させる（NAT やロードバランサに黙って切られないように）
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """新規接続の DNS・TCP・TLS の所要時間を別々に記録する HTTPS 接続"""
+
+    def _new_conn(self):
+        host = self._dns_host
+        addresses = []
+        if not self.proxy and not _is_ip(host):
+            start = time.perf_counter()
+            try:
+                infos = socket.getaddrinfo(host, self.port, type=socket.SOCK_STREAM)
+            except socket.gaierror:
+                infos = []  # 元の処理に任せて NameResolutionError にする
+            SHEETS_TRANSPORT_SECONDS.observe(time.perf_counter() - start, phase="dns")
+            for info in infos:
+                if info[4][0] not in addresses:
+                    addresses.append(info[4][0])
+
+        # 解決済みのアドレスへ順につなぐ（IPv6 に届かなければ IPv4 へ、と
+        # create_connection と同じく全部を試す。証明書の検証と SNI は self.host のまま）
+        start = time.perf_counter()
+        try:
+            if not addresses:
+                return super()._new_conn()
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (ConnectTimeoutError, NewConnectionError):
+                    if i + 1 == len(addresses):
+                        raise
+        finally:
+            self._dns_host = host
+            self._tcp_seconds = time.perf_counter() - start
+            SHEETS_TRANSPORT_SECONDS.observe(self._tcp_seconds, phase="tcp")
+
+    def connect(self):
+        self._tcp_seconds = 0.0
+        start = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start
+        SHEETS_CONNECTIONS.inc()
+        # connect() の時間から DNS・TCP を除いた残りが TLS ハンドシェイク
+        SHEETS_TRANSPORT_SECONDS.observe(max(elapsed - self._tcp_seconds, 0.0), phase="tls")
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+class PooledAdapter(HTTPAdapter):
+    """接続数を決めたキープアライブのプール（新規接続は TimedHTTPSConnection で計測）"""
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("socket_options", KEEPALIVE_SOCKET_OPTIONS)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": HTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class SheetsTransport:
+    """gspread に渡す HTTP セッションとアクセストークンの更新を受け持つ
+
+    session は pool_size 本までの接続を使い回す AuthorizedSession。トークンは
+    期限の refresh_margin 秒前にバックグラウンドで更新するので、参加者の
+    リクエスト中に google-auth が更新を始めることはない（更新に失敗し続けて
+    期限が切れた場合だけ、従来どおりその場で更新する。inline として数える）。
+    """
+
+    def __init__(self, credentials, pool_size=10, refresh_margin=600.0, max_backoff=60.0):
+        self.credentials = credentials
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+        self.max_backoff = max_backoff
+
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._local = threading.local()
+        self.refreshes = {"background": 0, "inline": 0}
+        self.last_refresh_at = None
+        self.last_refresh_seconds = None
+        self.last_error = ""
+
+        # トークン取得（oauth2.googleapis.com）用と API 用で別のセッションにする
+        self._token_session = self._new_session(requests.Session())
+        self._token_request = Request(self._token_session)
+        self.session = self._new_session(AuthorizedSession(credentials, auth_request=self._token_request))
+
+        # google-auth がどこから更新しても計測・排他されるようにインスタンスの refresh を包む
+        original_refresh = credentials.refresh
+
+        def refresh(request):
+            source = "background" if getattr(self._local, "background", False) else "inline"
+            token = credentials.token
+            with self._refresh_lock:
+                if source == "inline" and credentials.token != token and credentials.valid:
+                    return  # 待っている間に別スレッドが更新した
+                start = time.perf_counter()
+                try:
+                    original_refresh(request)
+                except Exception:
+                    SHEETS_TOKEN_REFRESHES.inc(source=source, outcome="error")
+                    raise
+                finally:
+                    SHEETS_TRANSPORT_SECONDS.observe(time.perf_counter() - start, phase="refresh")
+                elapsed = time.perf_counter() - start
+                SHEETS_TOKEN_REFRESHES.inc(source=source, outcome="ok")
+                self.refreshes[source] += 1
+                self.last_refresh_at = time.time()
+                self.last_refresh_seconds = elapsed
+
+        credentials.refresh = refresh
+
+    def _new_session(self, session):
+        adapter = PooledAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        return session
+
+    # ---- バックグラウンド更新 ----
+
+    def start(self):
+        """最初のトークンをこのスレッドで取得してから、更新スレッドを始める"""
+        self.refresh()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheets-token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        self._local.background = True
+        try:
+            self.credentials.refresh(self._token_request)
+        finally:
+            self._local.background = False
+
+    def seconds_until_refresh(self):
+        expiry = self.credentials.expiry  # google-auth は naive な UTC で持つ
+        if expiry is None:
+            return 0.0
+        remaining = (expiry - _utcnow()).total_seconds()
+        return max(remaining - self.refresh_margin, 0.0)
+
+    def _run(self):
+        delay = 1.0
+        while not self._stop.wait(self.seconds_until_refresh()):
+            try:
+                self.refresh()
+                self.last_error = ""
+                delay = 1.0
+            except Exception as e:
+                self.last_error = repr(e)
+                print(f"[sheets] token refresh failed, retrying in {delay:.0f}s: {e!r}")
+                if self._stop.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_backoff)
+
+    def stats(self):
+        expiry = self.credentials.expiry
+        return {
+            "pool_size": self.pool_size,
+            "token_expires_in": round((expiry - _utcnow()).total_seconds()) if expiry else None,
+            "refreshes": dict(self.refreshes),
+            "last_refresh_seconds": round(self.last_refresh_seconds, 3) if self.last_refresh_seconds else None,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,287 @@
+"""イベントログを参加者ごとのファネル・滞在時間・購入明細にまとめる（オフライン集計）
+
+入力は Sheets から書き出した CSV（見出し行の有無どちらでも）か、data/wal/ の
+JSONL セグメント（同じイベントを両方から渡すと二重に数える）。chunksize 行ずつ読み、チャンクごとに pandas / NumPy で
+ベクトル演算するので、数百万行でもメモリは「参加者数 × 段階数」程度に収まる。
+
+出力（--out のディレクトリ、--format parquet|csv）:
+    line_items   products・quantities・subtotals・colors・sizes を1商品1行に展開した表
+    participants 参加者ごとの各段階の初回時刻・段階間の秒数・購入合計
+    funnel       条件ごとに各段階へ到達した参加者数と割合
+    dwell        条件ごとの段階間の秒数（中央値・p90）
+
+    pip install -r requirements-analytics.txt
+    python tools/analytics.py export.csv data/wal/log-*.jsonl --out analytics --format parquet
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # 集計専用の依存（アプリ本体には不要）
+    sys.exit("pandas / numpy が必要です: pip install -r requirements-analytics.txt")
+
+# app.log_action が書く列の順番
+LOG_COLUMNS = [
+    "timestamp", "participant_id", "condition", "action", "total_price",
+    "products", "quantities", "subtotals", "colors", "sizes", "page",
+]
+PACKED_COLUMNS = ["products", "quantities", "subtotals", "colors", "sizes"]
+
+# ファネルの段階（action の値 → 段階番号）
+STEPS = ["index", "detail", "add", "cart", "confirm", "purchase"]
+STEP_ACTIONS = {
+    "index": ("条件決定", "商品一覧表示"),
+    "detail": ("商品詳細表示",),           # 「商品詳細表示: 001」のように前方一致
+    "add": ("カートに追加",),
+    "cart": ("カート表示", "カートを見る"),
+    "confirm": ("購入確認画面表示", "確認画面へ進む"),
+    "purchase": ("購入確定",),
+}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# ---- 入力 ----
+
+def _has_header(path):
+    with open(path, encoding="utf-8-sig") as f:
+        return f.readline().split(",", 1)[0].strip() == "timestamp"
+
+
+def read_csv_chunks(path, chunksize):
+    header = _has_header(path)
+    reader = pd.read_csv(
+        path, header=0 if header else None, names=None if header else LOG_COLUMNS,
+        dtype=str, keep_default_na=False, chunksize=chunksize, encoding="utf-8-sig",
+        on_bad_lines="warn",
+    )
+    for chunk in reader:
+        yield chunk.reindex(columns=LOG_COLUMNS, fill_value="")
+
+
+def read_wal_chunks(path, chunksize):
+    """EventWAL のセグメント（1行 = {"pid": ..., "row": [...]}）"""
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)["row"]
+            except (ValueError, KeyError, TypeError):
+                continue  # 書きかけの最終行など
+            rows.append([str(v) for v in row[:len(LOG_COLUMNS)]])
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows, columns=LOG_COLUMNS[:max(map(len, rows))]).reindex(
+                    columns=LOG_COLUMNS, fill_value="")
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=LOG_COLUMNS[:max(map(len, rows))]).reindex(
+            columns=LOG_COLUMNS, fill_value="")
+
+
+def read_chunks(paths, chunksize):
+    for path in paths:
+        if path.endswith(".jsonl"):
+            yield from read_wal_chunks(path, chunksize)
+        else:
+            yield from read_csv_chunks(path, chunksize)
+
+
+# ---- 変換 ----
+
+def classify_steps(action: pd.Series) -> np.ndarray:
+    conditions = [action.str.startswith(STEP_ACTIONS[step]) for step in STEPS]
+    return np.select(conditions, np.arange(len(STEPS)), default=-1)
+
+
+def explode_line_items(chunk: pd.DataFrame) -> pd.DataFrame:
+    """カンマ区切りの列を (行, 位置) で揃えて1商品1行にする（長さが違う列は空欄で埋める）"""
+    packed = chunk[chunk["products"] != ""]
+    if packed.empty:
+        return pd.DataFrame(columns=["timestamp", "participant_id", "condition", "action", "line",
+                                     "product", "quantity", "subtotal", "color", "size"])
+    base = packed["products"].str.split(",").explode().rename("product").to_frame()
+    base["line"] = base.groupby(level=0).cumcount()
+    base = base.set_index("line", append=True)
+    for column, name in (("quantities", "quantity"), ("subtotals", "subtotal"),
+                         ("colors", "color"), ("sizes", "size")):
+        values = packed[column].str.split(",").explode().rename(name).to_frame()
+        values["line"] = values.groupby(level=0).cumcount()
+        base = base.join(values.set_index("line", append=True), how="left")
+    base = base.reset_index(level="line")
+    meta = packed[["timestamp", "participant_id", "condition", "action"]]
+    items = meta.join(base, how="inner").reset_index(drop=True)
+    items["timestamp"] = pd.to_datetime(items["timestamp"], format=TIME_FORMAT, errors="coerce")
+    items["quantity"] = pd.to_numeric(items["quantity"], errors="coerce").fillna(0).astype("int64")
+    items["subtotal"] = pd.to_numeric(items["subtotal"], errors="coerce").fillna(0).astype("int64")
+    items[["color", "size"]] = items[["color", "size"]].fillna("")
+    return items[["timestamp", "participant_id", "condition", "action", "line",
+                  "product", "quantity", "subtotal", "color", "size"]]
+
+
+class Aggregates:
+    """チャンクをまたいで持つ参加者単位の集計（大きさは参加者数 × 段階数）"""
+
+    def __init__(self):
+        self.first_seen = None   # (participant_id, step) → 初回時刻
+        self.condition = None    # participant_id → 条件（最後に記録されたもの）
+        self.events = None       # participant_id → イベント数
+        self.purchase = None     # participant_id → [購入合計, 購入回数]
+        self.rows = 0
+
+    @staticmethod
+    def _combine(current, new, how):
+        if current is None:
+            return new
+        combined = pd.concat([current, new])
+        return getattr(combined.groupby(level=list(range(combined.index.nlevels))), how)()
+
+    def add(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        chunk = chunk[chunk["participant_id"] != ""]
+        ts = pd.to_datetime(chunk["timestamp"], format=TIME_FORMAT, errors="coerce")
+        step = classify_steps(chunk["action"])
+
+        events = chunk.groupby("participant_id").size()
+        self.events = self._combine(self.events, events, "sum")
+
+        with_condition = chunk[chunk["condition"] != ""]
+        condition = with_condition.groupby("participant_id")["condition"].last()
+        self.condition = self._combine(self.condition, condition, "last")
+
+        stepped = pd.DataFrame({"participant_id": chunk["participant_id"].to_numpy(), "step": step, "ts": ts.to_numpy()})
+        stepped = stepped[(stepped["step"] >= 0) & stepped["ts"].notna()]
+        first = stepped.groupby(["participant_id", "step"])["ts"].min()
+        self.first_seen = self._combine(self.first_seen, first, "min")
+
+        purchases = chunk[step == STEPS.index("purchase")]
+        totals = pd.to_numeric(purchases["total_price"], errors="coerce").fillna(0)
+        purchase = pd.DataFrame({"total": totals, "count": 1}).groupby(purchases["participant_id"]).sum()
+        self.purchase = self._combine(self.purchase, purchase, "sum")
+
+    def participants(self) -> pd.DataFrame:
+        if self.events is None:
+            return pd.DataFrame()
+        table = pd.DataFrame({"condition": self.condition, "events": self.events})
+        table["condition"] = table["condition"].fillna("")
+        first = self.first_seen.unstack("step") if self.first_seen is not None else pd.DataFrame()
+        # 誰も到達しなかった段階も NaT の列として揃える
+        first = first.reindex(columns=range(len(STEPS))).astype("datetime64[ns]")
+        first.columns = [f"{name}_at" for name in STEPS]
+        table = table.join(first)
+        for a, b in zip(STEPS, STEPS[1:]):
+            table[f"{a}_to_{b}_s"] = (table[f"{b}_at"] - table[f"{a}_at"]).dt.total_seconds()
+        purchase = self.purchase if self.purchase is not None else pd.DataFrame(columns=["total", "count"])
+        table = table.join(purchase.rename(columns={"total": "purchase_total", "count": "purchases"}))
+        table[["purchase_total", "purchases"]] = table[["purchase_total", "purchases"]].fillna(0).astype("int64")
+        table.index.name = "participant_id"
+        return table.reset_index()
+
+
+def funnel(participants: pd.DataFrame) -> pd.DataFrame:
+    # 手前の段階をすべて通った参加者だけを数える（段階を飛ばしたら以降は数えない）
+    reached = participants[[f"{s}_at" for s in STEPS]].notna().cummin(axis=1)
+    reached.columns = STEPS
+    counts = reached.groupby(participants["condition"]).sum()
+    rows = counts.stack().rename("participants").reset_index()
+    rows.columns = ["condition", "step", "participants"]
+    start = rows.groupby("condition")["participants"].transform("first")
+    previous = rows.groupby("condition")["participants"].shift(1).fillna(rows["participants"])
+    rows["rate_from_start"] = np.where(start > 0, rows["participants"] / start.where(start > 0, 1), 0.0)
+    rows["rate_from_previous"] = np.where(previous > 0, rows["participants"] / previous.where(previous > 0, 1), 0.0)
+    return rows
+
+
+def dwell(participants: pd.DataFrame) -> pd.DataFrame:
+    columns = [f"{a}_to_{b}_s" for a, b in zip(STEPS, STEPS[1:])]
+    long = participants.melt(id_vars="condition", value_vars=columns, var_name="transition", value_name="seconds")
+    long = long[long["seconds"].notna() & (long["seconds"] >= 0)]
+    grouped = long.groupby(["condition", "transition"])["seconds"]
+    return pd.DataFrame({
+        "participants": grouped.size(),
+        "median_s": grouped.median(),
+        "p90_s": grouped.quantile(0.9),
+    }).reset_index()
+
+
+# ---- 出力 ----
+
+class TableWriter:
+    """チャンクごとに追記する（Parquet は pyarrow の ParquetWriter、CSV は追記）"""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self._writer = None
+        self._started = False
+
+    def write(self, df: pd.DataFrame):
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            df.to_csv(self.path, mode="a" if self._started else "w", header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def write_table(df, out_dir, name, fmt):
+    writer = TableWriter(os.path.join(out_dir, f"{name}.{fmt}"), fmt)
+    writer.write(df)
+    writer.close()
+
+
+def run(paths, out_dir, fmt="csv", chunksize=200_000):
+    os.makedirs(out_dir, exist_ok=True)
+    aggregates = Aggregates()
+    items = TableWriter(os.path.join(out_dir, f"line_items.{fmt}"), fmt)
+    item_count = 0
+    try:
+        for chunk in read_chunks(paths, chunksize):
+            aggregates.add(chunk)
+            exploded = explode_line_items(chunk)
+            if not exploded.empty:
+                items.write(exploded)
+                item_count += len(exploded)
+    finally:
+        items.close()
+
+    participants = aggregates.participants()
+    write_table(participants, out_dir, "participants", fmt)
+    if not participants.empty:
+        write_table(funnel(participants), out_dir, "funnel", fmt)
+        write_table(dwell(participants), out_dir, "dwell", fmt)
+    return {"events": aggregates.rows, "line_items": item_count, "participants": len(participants)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("inputs", nargs="+", help="CSV（Sheets の書き出し）か WAL の .jsonl。glob も可")
+    parser.add_argument("--out", default="analytics")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--chunksize", type=int, default=200_000)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.inputs for p in (glob.glob(pattern) or [pattern])})
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Parquet 出力には pyarrow が必要です: pip install -r requirements-analytics.txt")
+    summary = run(paths, args.out, args.format, args.chunksize)
+    print(f"[analytics] {summary['events']} events, {summary['line_items']} line items, "
+          f"{summary['participants']} participants → {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
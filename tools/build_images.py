@@ -0,0 +1,137 @@
+"""static/images から配信用の画像を作る（デプロイ時に1回実行する）
+
+同じ内容のファイル（例: mag_a.jpg と mag_a_1.jpg）は内容ハッシュでまとめ、
+用途ごとの幅に縮小した WebP / JPEG を static/build/images/ に書き出す。
+ファイル名に内容ハッシュを含めるので、配信時は immutable で長期キャッシュできる。
+元ファイル名 → 各サイズの URL の対応は static/build/images.json に書く
+（テンプレートからは assets.image_url() 経由で参照する）。
+
+Pillow が無い環境では縮小せず、元の JPEG をハッシュ付きの名前でコピーするだけにする。
+
+    python tools/build_images.py
+    python tools/build_images.py --source static/images --out static/build
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow はビルド時だけの任意依存
+    Image = None
+
+# 用途 → 最大幅（px）。一覧・カートのサムネイルは 200px 程度で表示するので 2 倍密度まで
+VARIANTS = {"thumb": 400, "gallery": 960}
+QUALITY = {"webp": 80, "jpeg": 82}
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def encode(image, fmt, quality):
+    buf = io.BytesIO()
+    if fmt == "webp":
+        image.save(buf, "WEBP", quality=quality, method=6)
+    else:
+        image.convert("RGB").save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def build_variants(data, digest, out_dir):
+    """1つの元画像から用途ごとの WebP / JPEG を作り、{用途: {形式: 相対パス, ...}} を返す"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    variants = {}
+    for name, max_width in VARIANTS.items():
+        resized = image
+        if image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            resized = image.resize((max_width, height), Image.LANCZOS)
+        entry = {"width": resized.width, "height": resized.height}
+        for fmt, quality in QUALITY.items():
+            ext = "webp" if fmt == "webp" else "jpg"
+            filename = f"{digest}-{name}.{ext}"
+            path = os.path.join(out_dir, filename)
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(encode(resized, fmt, quality))
+            entry[fmt] = filename
+        variants[name] = entry
+    return variants
+
+
+def copy_original(data, digest, source_name, out_dir):
+    ext = os.path.splitext(source_name)[1].lower()
+    filename = f"{digest}-orig{ext}"
+    path = os.path.join(out_dir, filename)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return {name: {"jpeg": filename} for name in VARIANTS}
+
+
+def build(source_dir, out_dir):
+    images_dir = os.path.join(out_dir, "images")
+    tmp_dir = images_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    names = sorted(n for n in os.listdir(source_dir) if n.lower().endswith(SOURCE_EXTENSIONS))
+    by_hash = {}
+    images = {}
+    source_bytes = 0
+    for name in names:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            data = f.read()
+        source_bytes += len(data)
+        digest = content_hash(data)
+        if digest not in by_hash:
+            if Image is not None:
+                by_hash[digest] = build_variants(data, digest, tmp_dir)
+            else:
+                by_hash[digest] = copy_original(data, digest, name, tmp_dir)
+        images[name] = {"hash": digest, "variants": by_hash[digest]}
+
+    # 書き出しが終わってから入れ替える（途中の状態を配信しない）
+    shutil.rmtree(images_dir, ignore_errors=True)
+    os.replace(tmp_dir, images_dir)
+    manifest = {"base": "build/images", "variants": sorted(VARIANTS), "images": images}
+    manifest_path = os.path.join(out_dir, "images.json")
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest, source_bytes, len(names), len(by_hash)
+
+
+def variant_bytes(out_dir, manifest, variant, fmt):
+    files = {entry["variants"][variant].get(fmt) for entry in manifest["images"].values()}
+    return sum(os.path.getsize(os.path.join(out_dir, "images", f)) for f in files if f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default=os.path.join("static", "images"))
+    parser.add_argument("--out", default=os.path.join("static", "build"))
+    args = parser.parse_args()
+
+    if Image is None:
+        print("[images] Pillow が無いため縮小せずにコピーします（pip install Pillow）", file=sys.stderr)
+    manifest, source_bytes, count, unique = build(args.source, args.out)
+
+    print(f"[images] {count} files, {unique} unique, source {source_bytes / 1024:.0f} KiB")
+    for variant in VARIANTS:
+        for fmt in QUALITY:
+            size = variant_bytes(args.out, manifest, variant, fmt)
+            if size:
+                print(f"[images]   {variant:8s} {fmt:5s} {size / 1024:7.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()